@@ -1,29 +1,30 @@
 import boto3
 import json
 import certifi
+import sys
+from bedrock_streaming import StreamMetrics, StubBedrockClient, claude_payload, stream_claude
+
+## Stream the answer as it is generated (set to False to wait for the full response)
+STREAM = True
+## `python Claude_Sonnet_Bedrock.py --stub` runs against a local stub instead of Bedrock
+USE_STUB = "--stub" in sys.argv
 
 # Setup bedrock client
 #bedrock = boto3.client(service_name='bedrock-runtime')
-bedrock = boto3.client(
-    service_name='bedrock-runtime',
-    region_name='<your region here>',
-    verify=certifi.where() ## to avoid SSL error
-)
+if USE_STUB:
+    bedrock = StubBedrockClient(text="Upon the brass and reed, a midnight tune...")
+else:
+    bedrock = boto3.client(
+        service_name='bedrock-runtime',
+        region_name='<your region here>',
+        verify=certifi.where() ## to avoid SSL error
+    )
 
 # Your prompt
 prompt_text = "Act as Shakespeare and write a poem on Jazz Music."
 
 # Payload
-payload = {
-    "anthropic_version": "bedrock-2023-05-31",
-    "max_tokens": 1000,
-    "messages": [
-        {
-            "role": "user",
-            "content": prompt_text
-        }
-    ]
-}
+payload = claude_payload(prompt_text, max_tokens=1000)
 
 # Convert payload to JSON string
 body = json.dumps(payload)
@@ -31,16 +32,24 @@ body = json.dumps(payload)
 # Model ID for Claude 3 Sonnet
 model_id = "<model id here>"
 
-# Invoke the model
-response = bedrock.invoke_model(
-    body=body,
-    modelId=model_id,
-    accept="application/json",
-    contentType="application/json"
-)
-
-# # Parse and print the response -- Claude-Sonnet 
-response_body = json.loads(response.get("body").read())
-response_text = response_body['content'][0]['text']
-print(response_text)
-
+if STREAM:
+    # Invoke the model with the response stream API and print chunks as they arrive
+    metrics = StreamMetrics()
+    for text in stream_claude(bedrock, model_id, payload, metrics):
+        print(text, end="", flush=True)
+    print()
+    print(f"Time to first token: {metrics.time_to_first_token or 0:.3f}s, "
+          f"tokens/sec: {metrics.tokens_per_second or 0:.1f}")
+else:
+    # Invoke the model
+    response = bedrock.invoke_model(
+        body=body,
+        modelId=model_id,
+        accept="application/json",
+        contentType="application/json"
+    )
+    
+    # # Parse and print the response -- Claude-Sonnet 
+    response_body = json.loads(response.get("body").read())
+    response_text = response_body['content'][0]['text']
+    print(response_text)
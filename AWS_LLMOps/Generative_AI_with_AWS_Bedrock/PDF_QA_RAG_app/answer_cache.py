@@ -0,0 +1,94 @@
+## Answer cache for the RetrievalQA path of the PDF QA RAG app
+## Repeated (or nearly repeated) questions are answered without an LLM round-trip.
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_query(query):
+    """Case- and whitespace-insensitive form of a question"""
+    return " ".join(query.lower().split()).rstrip("?!. ")
+
+
+class AnswerCache:
+    """In-process LRU + TTL cache of answers.
+
+    Exact lookup is keyed on (index version, llm id, normalized query). If
+    `embeddings` is given, a miss falls back to a semantic lookup: the answer of a
+    cached question on the same index/llm whose query embedding has cosine
+    similarity >= `similarity_threshold` is reused.
+    """
+
+    def __init__(self, max_entries=1000, ttl_seconds=24 * 3600, embeddings=None, similarity_threshold=0.95):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.embeddings = embeddings
+        self.similarity_threshold = similarity_threshold
+        self._entries = OrderedDict()  ## key -> (answer, unit query vector or None, created)
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "semantic_hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+    def _expired(self, created):
+        return self.ttl_seconds is not None and time.time() - created > self.ttl_seconds
+
+    def _embed(self, query):
+        vector = np.asarray(self.embeddings.embed_query(query), dtype="float32")
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _semantic_lookup(self, vector, index_version, llm_id):
+        best_key, best_score = None, self.similarity_threshold
+        for key, (_, cached_vector, created) in self._entries.items():
+            if key[:2] != (index_version, llm_id) or cached_vector is None or self._expired(created):
+                continue
+            score = float(vector @ cached_vector)
+            if score >= best_score:
+                best_key, best_score = key, score
+        return best_key
+
+    def get(self, query, index_version="", llm_id="", semantic=True):
+        """Cached answer for `query` or None. Returns (answer, query_vector).
+
+        `semantic=False` skips the semantic lookup (and with it the query embedding).
+        """
+        key = (index_version, llm_id, normalize_query(query))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if self._expired(entry[2]):
+                    del self._entries[key]
+                    self.stats["expired"] += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return entry[0], entry[1]
+
+        vector = None
+        if self.embeddings is not None and semantic:
+            vector = self._embed(query)
+            with self._lock:
+                match = self._semantic_lookup(vector, index_version, llm_id)
+                if match is not None:
+                    self._entries.move_to_end(match)
+                    self.stats["semantic_hits"] += 1
+                    return self._entries[match][0], vector
+        with self._lock:
+            self.stats["misses"] += 1
+        return None, vector
+
+    def put(self, query, answer, index_version="", llm_id="", query_vector=None, semantic=True):
+        if self.embeddings is not None and query_vector is None and semantic:
+            query_vector = self._embed(query)
+        key = (index_version, llm_id, normalize_query(query))
+        with self._lock:
+            self._entries[key] = (answer, query_vector, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
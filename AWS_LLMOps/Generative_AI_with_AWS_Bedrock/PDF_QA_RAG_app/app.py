@@ -1,3 +1,4 @@
+import hashlib
 import json 
 import os 
 import sys 
@@ -17,15 +18,22 @@ from langchain_community.chat_models import BedrockChat
 
 ## Data ingestion libraries
 import numpy as np
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import PyPDFDirectoryLoader
+from ingestion import add_documents_in_batches, clear_manifest, incremental_update, iter_chunks
 
 ## Vector Embeddings and Vector Store 
 from langchain_community.vectorstores import FAISS
+from embedding_cache import CachedEmbeddings
+from batch_embeddings import ConcurrentEmbeddings
+from index_options import build_serving_index, serving_index_dir
+from mmap_store import MmapVectorStore, export_faiss_store
 
 ### LLM models via AWS Bedrock
 from langchain.prompts import PromptTemplate
-from langchain.chains import RetrievalQA
+from langchain.chains.question_answering import load_qa_chain
+from context_packing import pack_context
+from bm25_index import BM25Index, is_keyword_query, reciprocal_rank_fusion
+from answer_cache import AnswerCache
+from bedrock_streaming import StreamMetrics, claude_payload, stream_claude
 
 ## AWS Bedrock Clients
 ## 1. Setup Bedrock Client
@@ -37,44 +45,144 @@ bedrock = boto3.client(
 ## 2. Setup bedrock embeddings
 bedrock_embeddings = BedrockEmbeddings(model_id="<model id here>",
                                        client=bedrock)
+## 3. Batched, concurrent embedding requests with adaptive rate limiting
+##    -- set requests_per_second to the InvokeModel quota of your account
+concurrent_embeddings = ConcurrentEmbeddings(bedrock_embeddings,
+                                             batch_size=16,
+                                             max_concurrency=8,
+                                             requests_per_second=20)
+## 4. Persistent embedding cache in front of Bedrock -- keyed on (model id, chunk hash)
+cached_embeddings = CachedEmbeddings(concurrent_embeddings,
+                                     path="embedding_cache.sqlite",
+                                     max_entries=1_000_000)
+
+## Data folder, local index folder and chunking settings
+DATA_DIR = "data"
+INDEX_DIR = "faiss_index"
+CHUNK_SIZE = 10000
+CHUNK_OVERLAP = 1000
+## Serving index type: "flat" (exact), "hnsw", "ivfpq", "sq8" or "sqfp16"
+## -- approximate indexes are built from the flat index and saved to faiss_index_<type>
+INDEX_TYPE = "flat"
+## Serving store format: "mmap" (memory-mapped, no pickle) or "faiss" (LangChain save_local)
+STORE_FORMAT = "mmap"
+MMAP_DIR = f"{INDEX_DIR}_mmap"
+## Local BM25 inverted index, stored next to the FAISS index
+BM25_PATH = f"{INDEX_DIR}_bm25.json.gz"
+## Retrieval mode: "vector", "bm25" or "hybrid" (BM25 + vector fused by reciprocal rank)
+RETRIEVAL_MODE = "hybrid"
+SERVE_INDEX_DIR = MMAP_DIR if STORE_FORMAT == "mmap" else serving_index_dir(INDEX_DIR, INDEX_TYPE)
 
 
 #### Data Ingestion
-def data_ingestion():
-    """Data Ingestion Pipeline Function"""
-    ## Load the documents from data folder
-    loader=PyPDFDirectoryLoader("data")
-    documents=loader.load()
-
-    ## text splitter
-    text_splitter=RecursiveCharacterTextSplitter(chunk_size=10000,
-                                                 chunk_overlap=1000)
-    ## split the documents
-    docs=text_splitter.split_documents(documents)
-    return docs
+def data_ingestion(max_workers=None, max_in_flight=None):
+    """Data Ingestion Pipeline Function
+
+    Returns a generator of chunks: PDFs are parsed and split over a process pool and
+    chunks are yielded as each document finishes, so embedding starts before parsing
+    ends. `max_in_flight` bounds how many parsed documents are held in memory.
+    """
+    return iter_chunks(DATA_DIR, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP,
+                       max_workers=max_workers, max_in_flight=max_in_flight)
 
 #### Vector Embeddings and Vector Store -- Titan Embeddings & FAISS
 def get_vector_store(docs):
     """Vector Store Function"""
-    ## Create Vector Store
-    vectorstore_faiss=FAISS.from_documents(
+    ## Create Vector Store -- chunks are embedded batch by batch as they stream in
+    vectorstore_faiss=add_documents_in_batches(
+        None,
         docs,
-        bedrock_embeddings,
+        cached_embeddings,
         #num_dimensions=512, ## model specific
     )
     ## Save vector store in local file index
-    vectorstore_faiss.save_local("faiss_index")
+    vectorstore_faiss.save_local(INDEX_DIR)
+    clear_manifest(INDEX_DIR)
     return vectorstore_faiss
 
+def update_vector_store():
+    """Incremental Vector Store Function -- only embeds new or changed chunks"""
+    return incremental_update(DATA_DIR, INDEX_DIR, cached_embeddings,
+                              chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+
+#### Process-wide cache of the index (+ docstore) and LLM clients
+def publish_serving_index(vectorstore):
+    """Build the serving index/store from the flat master index. Returns the build report (or None)"""
+    report = None
+    serving_index = None
+    if INDEX_TYPE != "flat":
+        ## train/build the approximate index and compare it with the exact one
+        serving_store, report = build_serving_index(INDEX_DIR, cached_embeddings, INDEX_TYPE)
+        serving_index = serving_store.index
+    if STORE_FORMAT == "mmap":
+        export_faiss_store(vectorstore, MMAP_DIR, index=serving_index)
+    ## keyword index over the same chunks (local tokenization only, no embedding calls)
+    BM25Index.from_vectorstore(vectorstore).save(BM25_PATH)
+    return report
+
+def index_fingerprint(index_dir=SERVE_INDEX_DIR):
+    """(file, mtime, size) of the index files -- changes whenever the index is rewritten"""
+    fingerprint = []
+    if os.path.isdir(index_dir):
+        for name in sorted(os.listdir(index_dir)):
+            stat = os.stat(os.path.join(index_dir, name))
+            fingerprint.append((name, stat.st_ino, stat.st_mtime_ns, stat.st_size))
+    return tuple(fingerprint)
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def _load_faiss_index(fingerprint):
+    """Load the vector store once per fingerprint"""
+    if STORE_FORMAT == "mmap":
+        ## memory-mapped: near-instant, no pickle, pages shared between worker processes
+        return MmapVectorStore.load(MMAP_DIR, cached_embeddings)
+    try:
+        # First, try loading with the allow_dangerous_deserialization parameter
+        return FAISS.load_local(SERVE_INDEX_DIR, cached_embeddings, allow_dangerous_deserialization=True)
+    except TypeError:
+        # If that fails, load without the parameter
+        return FAISS.load_local(SERVE_INDEX_DIR, cached_embeddings)
+
+def load_vector_store():
+    """Return the cached vector store, reloading it only if the files on disk changed"""
+    return _load_faiss_index(index_fingerprint())
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def _load_bm25_index(fingerprint):
+    """Load the BM25 index once per version of the file (hit texts come from the vector store)"""
+    return BM25Index.load(BM25_PATH) if fingerprint else None
+
+def load_bm25_index():
+    """Return the cached BM25 index (None if it was not built yet)"""
+    if not os.path.exists(BM25_PATH):
+        return None
+    stat = os.stat(BM25_PATH)
+    return _load_bm25_index((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+
+def index_version():
+    """Short id of the serving index on disk -- cached answers are only valid for one version"""
+    return hashlib.sha256(repr(index_fingerprint()).encode()).hexdigest()[:16]
+
+@st.cache_resource
+def get_answer_cache():
+    """Process-wide answer cache (exact + semantic lookup, LRU/TTL eviction)"""
+    return AnswerCache(max_entries=1000,
+                       ttl_seconds=24 * 3600,
+                       embeddings=cached_embeddings, ## query vectors are cached too
+                       similarity_threshold=0.95)
+
 #### LLM Models via AWS Bedrock
+HAIKU_MODEL_ID = "<model id here>"
+
+@st.cache_resource
 def get_haiku_llm():
     """Function to create Anthropic Claude LLM from Bedrock"""
-    llm=BedrockChat(model_id="<model id here>",
+    llm=BedrockChat(model_id=HAIKU_MODEL_ID,
                 client=bedrock,
                 model_kwargs={"max_tokens": 1000})
     return llm
 
 ## if you want to use llama-3 instead
+# @st.cache_resource
 # def get_llama_llm():
 #     """Function to create Meta Llama 3 LLM from Bedrock"""
 #     llm=Bedrock(model_id="<model id here>",
@@ -103,24 +211,103 @@ PROMPT=PromptTemplate(
     input_variables=["context", "question"],
 )
 
+#### Context assembly -- dedupe overlapping chunks, order by score, trim to a token budget
+RETRIEVE_K = 5
+CONTEXT_TOKEN_BUDGET = 6000
+
+def use_keyword_fast_path(query):
+    """Queries that are mostly identifiers/exact terms skip the embedding round-trip"""
+    return RETRIEVAL_MODE != "vector" and load_bm25_index() is not None and is_keyword_query(query)
+
+def retrieve_context(vectorstore_faiss, query, packing_report=None):
+    """Retrieve the top chunks and pack them for the "stuff" prompt"""
+    bm25_index = load_bm25_index() if RETRIEVAL_MODE != "vector" else None
+    docs_and_scores = []
+    if bm25_index is not None and (RETRIEVAL_MODE == "bm25" or is_keyword_query(query)):
+        ## keyword-only fast path -- no remote embedding call
+        docs_and_scores = bm25_index.search(query, k=RETRIEVE_K, docstore=vectorstore_faiss)
+    if not docs_and_scores:
+        docs_and_scores = vectorstore_faiss.similarity_search_with_relevance_scores(query, k=RETRIEVE_K)
+        if bm25_index is not None and RETRIEVAL_MODE == "hybrid":
+            docs_and_scores = reciprocal_rank_fusion(
+                [docs_and_scores, bm25_index.search(query, k=RETRIEVE_K, docstore=vectorstore_faiss)], k=RETRIEVE_K)
+    docs, report = pack_context(docs_and_scores, token_budget=CONTEXT_TOKEN_BUDGET)
+    if packing_report is not None:
+        packing_report.update(report)
+    return docs
+
 #### Response 
-def get_response(llm, vectorstore_faiss, query):
+def get_response(llm, vectorstore_faiss, query, answer_cache=None, packing_report=None):
     """Function to get response from LLM"""
-    ## Create a retrieval QA chain
-    qa=RetrievalQA.from_chain_type(
+    ## Answer cache -- repeated questions skip retrieval and the LLM round-trip
+    if answer_cache is not None:
+        version, llm_id = index_version(), getattr(llm, "model_id", "")
+        semantic = not use_keyword_fast_path(query)
+        cached, query_vector = answer_cache.get(query, version, llm_id, semantic=semantic)
+        if cached is not None:
+            return cached
+
+    ## Search within the vector store and pack the context
+    docs = retrieve_context(vectorstore_faiss, query, packing_report)
+
+    ## Create a "stuff" QA chain over the packed passages
+    qa=load_qa_chain(
         llm=llm,
         chain_type="stuff",
-        ## Search within the vector store
-        retriever=vectorstore_faiss.as_retriever(
-            search_type="similarity",
-            search_kwargs={"k": 5},
-        ),
-        return_source_documents=True,
-        chain_type_kwargs={"prompt": PROMPT},
-        
+        prompt=PROMPT,
     )   ## return answer
-    answer=qa({"query": query})
-    return answer['result']
+    answer=qa({"input_documents": docs, "question": query})
+    if answer_cache is not None:
+        answer_cache.put(query, answer['output_text'], version, llm_id,
+                         query_vector=query_vector, semantic=semantic)
+    return answer['output_text']
+
+def stream_response(vectorstore_faiss, query, answer_cache=None, metrics=None, model_id=HAIKU_MODEL_ID,
+                    packing_report=None):
+    """Streaming version of get_response -- yields the answer in chunks as Bedrock generates it"""
+    if answer_cache is not None:
+        version = index_version()
+        semantic = not use_keyword_fast_path(query)
+        cached, query_vector = answer_cache.get(query, version, model_id, semantic=semantic)
+        if cached is not None:
+            yield cached
+            return
+
+    ## same retrieval, packing and "stuff" prompt as get_response
+    docs = retrieve_context(vectorstore_faiss, query, packing_report)
+    prompt = PROMPT.format(context="\n\n".join(d.page_content for d in docs), question=query)
+
+    metrics = metrics if metrics is not None else StreamMetrics()
+    parts = []
+    for text in stream_claude(bedrock, model_id, claude_payload(prompt, max_tokens=1000), metrics):
+        parts.append(text)
+        yield text
+    ## only cache answers whose stream finished normally
+    if answer_cache is not None and metrics.completed:
+        answer_cache.put(query, "".join(parts), version, model_id,
+                         query_vector=query_vector, semantic=semantic)
+
+def answer_question(user_question, stream_output):
+    """Render the answer for one of the LLM output buttons"""
+    ## cached per process -- only reloaded when the index files change
+    faiss_index = load_vector_store()
+    packing_report = {}
+    if stream_output:
+        metrics = StreamMetrics()
+        st.write_stream(stream_response(faiss_index, user_question, get_answer_cache(), metrics,
+                                        packing_report=packing_report))
+        if metrics.first_token_at is not None:
+            st.caption(f"Time to first token: {metrics.time_to_first_token:.2f}s | "
+                       f"Tokens/sec: {metrics.tokens_per_second or 0:.1f}")
+    else:
+        with st.spinner("Processing..."):
+            llm = get_haiku_llm()
+            st.write(get_response(llm, faiss_index, user_question, get_answer_cache(),
+                                  packing_report=packing_report))
+    if packing_report:
+        st.caption(f"Prompt tokens saved by context packing: {packing_report['prompt_tokens_saved']} "
+                   f"({packing_report['prompt_tokens_before']} -> {packing_report['prompt_tokens_after']})")
+    st.success("Done")
 
 
 #### Build Streamlit App
@@ -135,44 +322,35 @@ def main():
     with st.sidebar:
         st.title("Update or Create Vector Store:")
 
+        ## full rebuild re-embeds every chunk, otherwise only changed files are processed
+        full_rebuild = st.checkbox("Full rebuild")
+
         if st.button("Vectors Update"):
             with st.spinner("Processing...."):
-                docs=data_ingestion()
-                vectorstore = get_vector_store(docs)
+                if full_rebuild:
+                    docs=data_ingestion()
+                    vectorstore = get_vector_store(docs)
+                else:
+                    vectorstore, stats = update_vector_store()
+                    st.write(stats)
+                report = publish_serving_index(vectorstore)
+                if report:
+                    st.write(report)
                 st.success("Done")
 
+        ## answer cache counters
+        st.caption(f"Answer cache: {get_answer_cache().stats}")
+
+    ## stream partial output as it arrives (time to first token is what users feel)
+    stream_output = st.checkbox("Stream output", value=True)
+
     ## LLM output button -- Claude Haiku
     if st.button("Claude Haiku Output"):
-        with st.spinner("Processing..."):
-            ## access the faiss index with the embeddings
-            try:
-                # First, try loading with the allow_dangerous_deserialization parameter
-                faiss_index = FAISS.load_local("faiss_index", bedrock_embeddings, allow_dangerous_deserialization=True)
-            except TypeError:
-                # If that fails, load without the parameter
-                faiss_index = FAISS.load_local("faiss_index", bedrock_embeddings)
-        
-            llm = get_haiku_llm()
-
-            st.write(get_response(llm, faiss_index, user_question))
-            st.success("Done")
+        answer_question(user_question, stream_output)
 
     ## LLM output button -- Meta Llama 3
     if st.button("Llama 3 Output"):
-        with st.spinner("Processing..."):
-            ## access the faiss index with the embeddings
-            try:
-                # First, try loading with the allow_dangerous_deserialization parameter
-                faiss_index = FAISS.load_local("faiss_index", bedrock_embeddings, allow_dangerous_deserialization=True)
-            except TypeError:
-                # If that fails, load without the parameter
-                faiss_index = FAISS.load_local("faiss_index", bedrock_embeddings)
-        
-            llm = get_haiku_llm()
-
-            st.write(get_response(llm, faiss_index, user_question))
-            st.success("Done")
-
+        answer_question(user_question, stream_output)
 
 if __name__ == "__main__":
     main()
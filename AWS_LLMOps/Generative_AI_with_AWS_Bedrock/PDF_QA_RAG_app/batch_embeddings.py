@@ -0,0 +1,153 @@
+## Batched, concurrent embedding requests with adaptive rate limiting
+## Wraps an embeddings model (e.g. BedrockEmbeddings) so that index builds send many
+## requests at once instead of one chunk at a time, while staying under the account quota.
+import hashlib
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.embeddings import Embeddings
+
+THROTTLING_CODES = ("ThrottlingException", "TooManyRequestsException",
+                    "ServiceUnavailableException", "ModelNotReadyException")
+
+
+def is_throttling_error(exc):
+    """True for Bedrock throttling errors (raw botocore or wrapped by LangChain)"""
+    response = getattr(exc, "response", None)
+    if isinstance(response, dict):
+        return response.get("Error", {}).get("Code") in THROTTLING_CODES
+    ## langchain_aws re-raises client errors as ValueError with the message only
+    message = str(exc)
+    return any(code in message for code in THROTTLING_CODES) or "Too many requests" in message
+
+
+class TokenBucket:
+    """Thread-safe token bucket whose refill rate adapts to throttling (AIMD).
+
+    `rate` tokens are added per second up to `capacity`. On throttling the rate is
+    halved (not below `min_rate`); every success adds `increase` back up to `max_rate`.
+    """
+
+    def __init__(self, rate, capacity=None, min_rate=0.5, max_rate=None, increase=0.1):
+        self.rate = float(rate)
+        self.max_rate = float(max_rate or rate)
+        self.min_rate = min_rate
+        self.increase = increase
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, tokens=1):
+        """Block until `tokens` are available"""
+        tokens = min(tokens, self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+
+
+class ConcurrentEmbeddings(Embeddings):
+    """Groups texts into batches and embeds them over a bounded thread pool.
+
+    Each text costs one token of the rate limiter (Titan embeds one text per
+    request). Throttled batches are retried with exponential backoff and jitter.
+    """
+
+    def __init__(self, embeddings, batch_size=16, max_concurrency=8, requests_per_second=20,
+                 max_retries=8, base_delay=0.5, max_delay=30.0):
+        self.embeddings = embeddings
+        self.model_id = getattr(embeddings, "model_id", type(embeddings).__name__)
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.bucket = TokenBucket(requests_per_second)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.throttled = 0
+
+    def _embed_batch(self, batch):
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire(len(batch))
+            try:
+                vectors = self.embeddings.embed_documents(batch)
+            except Exception as e:
+                if not is_throttling_error(e) or attempt == self.max_retries:
+                    raise
+                self.throttled += 1
+                self.bucket.on_throttle()
+                ## full jitter backoff
+                time.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
+                continue
+            self.bucket.on_success()
+            return vectors
+
+    def embed_documents(self, texts):
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) <= 1:
+            return self._embed_batch(batches[0]) if batches else []
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+            ## map keeps the input order
+            results = pool.map(self._embed_batch, batches)
+            return [vector for batch in results for vector in batch]
+
+    def embed_query(self, text):
+        return self._embed_batch([text])[0]
+
+
+class FakeEmbeddings(Embeddings):
+    """Local stand-in for the Bedrock embedding endpoint (for tests and benchmarks).
+
+    Returns deterministic vectors derived from the text hash after `latency`
+    seconds per request, and raises a throttling error when more than
+    `max_concurrent` requests are in flight at once.
+    """
+
+    def __init__(self, dimensions=8, latency=0.05, max_concurrent=None):
+        self.model_id = "fake-embeddings"
+        self.dimensions = dimensions
+        self.latency = latency
+        self.max_concurrent = max_concurrent
+        self.calls = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def _vector(self, text):
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        return [b / 255.0 for b in digest[:self.dimensions]]
+
+    def embed_documents(self, texts):
+        with self._lock:
+            self.calls += 1
+            self._in_flight += 1
+            over_limit = self.max_concurrent is not None and self._in_flight > self.max_concurrent
+        try:
+            if over_limit:
+                raise ValueError("Error raised by inference endpoint: ThrottlingException: Too many requests")
+            time.sleep(self.latency)
+            return [self._vector(t) for t in texts]
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
@@ -0,0 +1,139 @@
+## Streaming Claude responses from Bedrock (invoke_model_with_response_stream)
+## Used by app.py and Claude_Sonnet_Bedrock.py to render partial output as chunks arrive
+## and to record time-to-first-token / tokens-per-second.
+import json
+import time
+
+
+class BedrockStreamError(RuntimeError):
+    """An exception event (throttlingException, modelStreamErrorException, ...) in the response stream"""
+
+
+class StreamMetrics:
+    """Timing of one streamed response"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.first_token_at = None
+        self.end = None
+        self.output_tokens = None
+        self.chunks = 0
+        self.stop_reason = None
+        self.completed = False  ## message_stop seen, i.e. the answer was not cut off by an error
+
+    @property
+    def time_to_first_token(self):
+        """Seconds from request to the first text delta"""
+        return None if self.first_token_at is None else self.first_token_at - self.start
+
+    @property
+    def tokens_per_second(self):
+        """Output tokens per second after the first token (chunk count if usage is missing)"""
+        if self.first_token_at is None or self.end is None:
+            return None
+        tokens = self.output_tokens if self.output_tokens is not None else self.chunks
+        elapsed = self.end - self.first_token_at
+        return tokens / elapsed if elapsed > 0 else None
+
+    def as_dict(self):
+        return {
+            "time_to_first_token_s": self.time_to_first_token,
+            "tokens_per_second": self.tokens_per_second,
+            "output_tokens": self.output_tokens,
+            "total_s": None if self.end is None else self.end - self.start,
+        }
+
+
+def claude_payload(prompt_text, max_tokens=1000):
+    """Anthropic messages API payload for Bedrock"""
+    return {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": max_tokens,
+        "messages": [{"role": "user", "content": prompt_text}],
+    }
+
+
+def stream_claude(client, model_id, payload, metrics=None):
+    """Yield text deltas of a Claude response as they arrive.
+
+    `metrics` (a StreamMetrics) is filled in while streaming; it is complete once
+    the generator is exhausted. Exception events in the stream raise BedrockStreamError.
+    """
+    metrics = metrics if metrics is not None else StreamMetrics()
+    response = client.invoke_model_with_response_stream(
+        body=json.dumps(payload),
+        modelId=model_id,
+        accept="application/json",
+        contentType="application/json",
+    )
+    for event in response["body"]:
+        if "chunk" not in event:
+            ## anything else is an error event, e.g. {"throttlingException": {"message": ...}}
+            for name, error in event.items():
+                message = error.get("message", "") if isinstance(error, dict) else error
+                raise BedrockStreamError(f"{name}: {message}")
+            continue
+        chunk = json.loads(event["chunk"]["bytes"])
+        if chunk.get("type") == "content_block_delta":
+            text = chunk.get("delta", {}).get("text", "")
+            if text:
+                if metrics.first_token_at is None:
+                    metrics.first_token_at = time.perf_counter()
+                metrics.chunks += 1
+                yield text
+        elif chunk.get("type") == "message_delta":
+            metrics.output_tokens = chunk.get("usage", {}).get("output_tokens", metrics.output_tokens)
+            metrics.stop_reason = chunk.get("delta", {}).get("stop_reason", metrics.stop_reason)
+        elif chunk.get("type") == "message_stop":
+            metrics.completed = True
+        invocation_metrics = chunk.get("amazon-bedrock-invocationMetrics")
+        if invocation_metrics:
+            metrics.output_tokens = invocation_metrics.get("outputTokenCount", metrics.output_tokens)
+    metrics.end = time.perf_counter()
+
+
+class StubBedrockClient:
+    """Local stand-in for the bedrock-runtime client that emits chunked stream events.
+
+    `text` is split into `chunk_size`-character deltas sent every `delay` seconds
+    after `first_token_delay`, in the same event format as Claude on Bedrock.
+    """
+
+    def __init__(self, text="Hello from the stub model.", chunk_size=4, delay=0.01, first_token_delay=0.05):
+        self.text = text
+        self.chunk_size = chunk_size
+        self.delay = delay
+        self.first_token_delay = first_token_delay
+        self.requests = []
+
+    @staticmethod
+    def _event(data):
+        return {"chunk": {"bytes": json.dumps(data).encode("utf-8")}}
+
+    def _events(self):
+        pieces = [self.text[i:i + self.chunk_size] for i in range(0, len(self.text), self.chunk_size)]
+        yield self._event({"type": "message_start", "message": {"usage": {"input_tokens": 10}}})
+        time.sleep(self.first_token_delay)
+        for i, piece in enumerate(pieces):
+            if i:
+                time.sleep(self.delay)
+            yield self._event({"type": "content_block_delta", "index": 0,
+                               "delta": {"type": "text_delta", "text": piece}})
+        yield self._event({"type": "message_delta", "delta": {"stop_reason": "end_turn"},
+                           "usage": {"output_tokens": len(pieces)}})
+        yield self._event({"type": "message_stop",
+                           "amazon-bedrock-invocationMetrics": {"outputTokenCount": len(pieces)}})
+
+    def invoke_model_with_response_stream(self, body, modelId, **kwargs):
+        self.requests.append({"body": json.loads(body), "modelId": modelId})
+        return {"body": self._events()}
+
+    def invoke_model(self, body, modelId, **kwargs):
+        self.requests.append({"body": json.loads(body), "modelId": modelId})
+        payload = json.dumps({"content": [{"type": "text", "text": self.text}]}).encode("utf-8")
+
+        class _Body:
+            def read(self_inner):
+                return payload
+
+        return {"body": _Body()}
@@ -0,0 +1,169 @@
+## Local BM25 inverted index for the PDF QA RAG app
+## Built at ingestion time from the chunks in the vector store and saved next to
+## `faiss_index`. Keyword-only queries (identifiers, exact terms) are answered from it
+## without the remote embedding call; hybrid mode fuses BM25 and vector rankings.
+import gzip
+import json
+import math
+import os
+import re
+from collections import Counter
+
+from langchain_core.documents import Document
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9_]+(?:[.\-/][a-z0-9_]+)*")
+## code-like tokens: letters plus an underscore (ERR_CODE), digits joined by - . / (INV-2023-114,
+## v2.1) or ALLCAPS with digits (E404). Bare numbers (2023) and capitalized words (iPhone) are not.
+_CODE_PATTERN = re.compile(r"^(?=.*[A-Za-z])(?:.*_.*|(?=.*[0-9])(?:.*[./\-].*|[A-Z0-9]+))$")
+_STOPWORDS = frozenset(
+    "a an and are as at be by did do does for from how in is it of on or the to was what when "
+    "where which who why with".split()
+)
+
+
+def tokenize(text):
+    """Lowercase word tokens; dotted/dashed identifiers (v2.1, ABC-123) are kept whole"""
+    return _TOKEN_PATTERN.findall(text.lower())
+
+
+def is_keyword_query(query, min_identifier_share=0.5):
+    """True if the query is mostly code-like tokens or an exact "quoted" term (everything else goes hybrid)"""
+    stripped = query.strip()
+    if len(stripped) > 1 and stripped[0] == stripped[-1] == '"':
+        return True
+    words = [w for w in re.findall(r"\S+", stripped) if w.lower().strip("?.,!") not in _STOPWORDS]
+    if not words:
+        return False
+    code_like = sum(1 for w in words if _CODE_PATTERN.match(w.strip("?.,!\"'")))
+    return code_like / len(words) >= min_identifier_share
+
+
+class BM25Index:
+    """Okapi BM25 over chunk texts.
+
+    Only the postings, document lengths and idf are kept (and persisted); the text of
+    a hit is fetched from the vector store's docstore (see get_document).
+    """
+
+    def __init__(self, k1=1.5, b=0.75, docstore=None):
+        self.k1 = k1
+        self.b = b
+        self.docstore = docstore  ## default store for search(); a vector store
+        self.ids = []
+        self.lengths = []
+        self.postings = {}  ## term -> {doc number: term frequency}
+        self.idf = None  ## term -> idf, computed on first search/save
+
+    @classmethod
+    def from_documents(cls, ids, docs, **kwargs):
+        index = cls(**kwargs)
+        for doc_id, doc in zip(ids, docs):
+            index.add(doc_id, doc.page_content)
+        return index
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore, **kwargs):
+        """Index every chunk of a LangChain FAISS store (in index order)"""
+        ids = [vectorstore.index_to_docstore_id[i] for i in range(len(vectorstore.index_to_docstore_id))]
+        return cls.from_documents(ids, [vectorstore.docstore.search(i) for i in ids],
+                                  docstore=vectorstore, **kwargs)
+
+    def add(self, doc_id, text):
+        n = len(self.ids)
+        tokens = tokenize(text)
+        self.ids.append(doc_id)
+        self.lengths.append(len(tokens))
+        for term, tf in Counter(tokens).items():
+            self.postings.setdefault(term, {})[n] = tf
+        self.idf = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _compute_idf(self):
+        n_docs = len(self.ids)
+        self.idf = {term: math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                    for term, postings in self.postings.items()}
+
+    def get_document(self, n, docstore):
+        """Document of doc number `n` from a vector store (None if the store no longer has it).
+
+        MmapVectorStore rows are in the same order as the index (checked by id); a
+        LangChain FAISS store is looked up by docstore id.
+        """
+        doc_id = self.ids[n]
+        if hasattr(docstore, "get_document"):
+            if n < len(docstore) and docstore.get_id(n) == doc_id:
+                return docstore.get_document(n)
+            return None
+        doc = docstore.docstore.search(doc_id)
+        return doc if isinstance(doc, Document) else None  ## InMemoryDocstore returns a message if missing
+
+    def search(self, query, k=5, docstore=None):
+        """Top-k (Document, BM25 score) pairs, texts fetched from `docstore` (default: self.docstore)"""
+        if not self.ids:
+            return []
+        if self.idf is None:
+            self._compute_idf()
+        docstore = docstore if docstore is not None else self.docstore
+        avg_length = sum(self.lengths) / len(self.ids) or 1.0
+        scores = Counter()
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf[term]
+            for n, tf in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[n] / avg_length)
+                scores[n] += idf * tf * (self.k1 + 1) / (tf + norm)
+        results = []
+        for n, score in scores.most_common():
+            doc = self.get_document(n, docstore)
+            if doc is not None:
+                results.append((doc, score))
+                if len(results) == k:
+                    break
+        return results
+
+    #### persistence (gzipped JSON -- no pickle); texts stay in the vector store
+    def save(self, path):
+        if self.idf is None:
+            self._compute_idf()
+        data = {"k1": self.k1, "b": self.b, "ids": self.ids, "lengths": self.lengths,
+                "postings": {term: [list(postings), list(postings.values())]
+                             for term, postings in self.postings.items()},
+                "idf": self.idf}
+        tmp_path = path + ".tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, docstore=None):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        index = cls(k1=data["k1"], b=data["b"], docstore=docstore)
+        if "postings" not in data:
+            ## older files stored the texts instead -- re-tokenize until the next "Vectors Update"
+            for doc_id, text in zip(data["ids"], data["texts"]):
+                index.add(doc_id, text)
+            return index
+        index.ids = data["ids"]
+        index.lengths = data["lengths"]
+        index.postings = {term: dict(zip(numbers, tfs)) for term, (numbers, tfs) in data["postings"].items()}
+        index.idf = data["idf"]
+        return index
+
+
+def reciprocal_rank_fusion(rankings, k=5, rrf_k=60):
+    """Fuse several [(Document, score)] rankings into one by reciprocal rank.
+
+    Documents are matched on their text; the fused score is sum(1 / (rrf_k + rank)).
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, (doc, _) in enumerate(ranking, start=1):
+            key = doc.page_content
+            doc_score = fused.get(key, (doc, 0.0))
+            fused[key] = (doc_score[0], doc_score[1] + 1.0 / (rrf_k + rank))
+    return sorted(fused.values(), key=lambda pair: pair[1], reverse=True)[:k]
@@ -0,0 +1,103 @@
+## Context packing and token budgeting for the "stuff" prompt of the PDF QA RAG app
+## Retrieved chunks overlap a lot (chunk_overlap=1000), so before stuffing them into the
+## prompt we drop duplicates, cut the overlapping text, order by score and trim to a budget.
+import hashlib
+import re
+
+from langchain_core.documents import Document
+
+try:
+    import tiktoken  ## optional -- local BPE tokenizer, only an approximation of Claude's
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except ImportError:
+    _ENCODING = None
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def count_tokens(text):
+    """Local token count (tiktoken if installed, otherwise a word/punctuation estimate)"""
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    return len(_TOKEN_PATTERN.findall(text))
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut `text` to at most `max_tokens` tokens"""
+    if max_tokens <= 0:
+        return ""
+    if _ENCODING is not None:
+        tokens = _ENCODING.encode(text)
+        return text if len(tokens) <= max_tokens else _ENCODING.decode(tokens[:max_tokens])
+    matches = list(_TOKEN_PATTERN.finditer(text))
+    return text if len(matches) <= max_tokens else text[:matches[max_tokens].start()].rstrip()
+
+
+def _overlap(left, right, min_overlap, max_overlap):
+    """Length of the longest suffix of `left` that is a prefix of `right` (0 if < min_overlap)"""
+    anchor = right[:min_overlap]
+    if len(anchor) < min_overlap:
+        return 0
+    idx = left.find(anchor, max(0, len(left) - max_overlap))
+    while idx != -1:
+        if right.startswith(left[idx:]):
+            return len(left) - idx
+        idx = left.find(anchor, idx + 1)
+    return 0
+
+
+def dedupe_passages(passages, min_overlap=50, max_overlap=2000):
+    """Drop duplicate/contained chunks and cut text already present in a better passage.
+
+    `passages` is a list of (text, score, metadata) sorted best first; returns the same shape.
+    """
+    kept = []
+    seen = set()
+    for text, score, metadata in passages:
+        digest = hashlib.sha256(" ".join(text.split()).encode("utf-8")).hexdigest()
+        if digest in seen or any(text in other for other, _, _ in kept):
+            continue
+        seen.add(digest)
+        for other, _, _ in kept:
+            ## neighbouring chunks share `chunk_overlap` characters at their edges
+            head = _overlap(other, text, min_overlap, max_overlap)
+            if head:
+                text = text[head:]
+            tail = _overlap(text, other, min_overlap, max_overlap)
+            if tail:
+                text = text[:len(text) - tail]
+        text = text.strip()
+        if text:
+            kept.append((text, score, metadata))
+    return kept
+
+
+def pack_context(docs_and_scores, token_budget=6000, min_overlap=50):
+    """Assemble the context passages for the prompt.
+
+    `docs_and_scores` are (Document, relevance score) pairs, higher score = better.
+    Returns (list of Documents, report) where the report has the prompt tokens
+    before/after packing and the tokens saved.
+    """
+    ordered = sorted(docs_and_scores, key=lambda pair: pair[1], reverse=True)
+    tokens_before = sum(count_tokens(doc.page_content) for doc, _ in ordered)
+
+    passages = [(doc.page_content, score, doc.metadata) for doc, score in ordered]
+
+    docs = []
+    tokens_after = 0
+    for text, score, metadata in dedupe_passages(passages, min_overlap=min_overlap):
+        remaining = token_budget - tokens_after
+        if remaining <= 0:
+            break
+        text = truncate_to_tokens(text, remaining)
+        tokens_after += count_tokens(text)
+        docs.append(Document(page_content=text, metadata={**metadata, "score": score}))
+    report = {
+        "passages_retrieved": len(ordered),
+        "passages_used": len(docs),
+        "prompt_tokens_before": tokens_before,
+        "prompt_tokens_after": tokens_after,
+        "prompt_tokens_saved": tokens_before - tokens_after,
+    }
+    return docs, report
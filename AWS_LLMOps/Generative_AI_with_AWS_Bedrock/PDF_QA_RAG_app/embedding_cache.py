@@ -0,0 +1,134 @@
+## Persistent embedding cache for the PDF QA RAG app
+## Sits in front of BedrockEmbeddings so rebuilds and re-chunking experiments reuse
+## vectors that were already paid for instead of calling Bedrock again.
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+from langchain_core.embeddings import Embeddings
+
+CACHE_PATH = "embedding_cache.sqlite"
+
+
+def normalize_text(text):
+    """Collapse whitespace so trivially different copies of a chunk share a key"""
+    return " ".join(text.split())
+
+
+def cache_key(text):
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class CachedEmbeddings(Embeddings):
+    """Disk-backed (SQLite) embedding cache keyed on (model id, normalized chunk hash).
+
+    Entries are evicted least-recently-used first once more than `max_entries`
+    vectors are stored.
+    """
+
+    def __init__(self, embeddings, model_id=None, path=CACHE_PATH, max_entries=1_000_000):
+        self.embeddings = embeddings
+        self.model_id = model_id or getattr(embeddings, "model_id", type(embeddings).__name__)
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        ## streamlit runs callbacks on worker threads, access is serialized by the lock
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS embeddings (
+                   model_id TEXT NOT NULL,
+                   text_hash TEXT NOT NULL,
+                   vector BLOB NOT NULL,
+                   last_used REAL NOT NULL,
+                   PRIMARY KEY (model_id, text_hash))"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings (last_used)")
+        self._conn.commit()
+
+    #### cache access
+    def _lookup(self, keys):
+        found = {}
+        unique = list(set(keys))
+        with self._lock:
+            ## sqlite limits the number of bound parameters per statement
+            for i in range(0, len(unique), 500):
+                part = unique[i:i + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model_id = ? AND text_hash IN ({placeholders})",
+                    [self.model_id, *part],
+                ).fetchall()
+                for text_hash, blob in rows:
+                    found[text_hash] = array("f", blob).tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model_id = ? AND text_hash = ?",
+                    [(now, self.model_id, k) for k in found],
+                )
+                self._conn.commit()
+        return found
+
+    def _store(self, items):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model_id, text_hash, vector, last_used) VALUES (?, ?, ?, ?)",
+                [(self.model_id, k, array("f", v).tobytes(), now) for k, v in items.items()],
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE rowid IN "
+                "(SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+
+    #### Embeddings interface
+    def embed_documents(self, texts):
+        keys = [cache_key(t) for t in texts]
+        found = self._lookup(keys)
+
+        ## embed each missing text once, even if it repeats within the batch
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self._store(computed)
+            found.update(computed)
+        return [found[k] for k in keys]
+
+    def embed_query(self, text):
+        ## some models embed queries differently from documents, keep them apart
+        key = "query:" + cache_key(text)
+        found = self._lookup([key])
+        if key in found:
+            self.hits += 1
+            return found[key]
+        self.misses += 1
+        vector = self.embeddings.embed_query(text)
+        self._store({key: vector})
+        return vector
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,155 @@
+## Approximate / compressed FAISS index options for the PDF QA RAG app
+## The flat (exact) index in `faiss_index/` stays the source of truth for incremental
+## updates; the options below are built from it and saved next to it for serving.
+## Run `python index_options.py --index-type hnsw` to build one and print a
+## recall-vs-latency report against the flat baseline.
+import argparse
+import math
+import time
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+
+INDEX_TYPES = ("flat", "ivfpq", "hnsw", "sq8", "sqfp16")
+
+
+def serving_index_dir(index_dir, index_type):
+    """Folder the serving index of `index_type` is saved to"""
+    return index_dir if index_type == "flat" else f"{index_dir}_{index_type}"
+
+
+def factory_string(index_type, n_vectors, dimensions, nlist=None, pq_m=None, hnsw_m=32):
+    """FAISS index_factory description for an index type"""
+    if index_type == "flat":
+        return "Flat"
+    if index_type == "hnsw":
+        return f"HNSW{hnsw_m}"
+    if index_type == "sq8":
+        return "SQ8"
+    if index_type == "sqfp16":
+        return "SQfp16"
+    if index_type == "ivfpq":
+        ## rule of thumb: ~4*sqrt(n) lists, and PQ needs >= 256 training points per codebook
+        if n_vectors < 256:
+            raise ValueError(f"IVF-PQ needs at least 256 vectors to train, got {n_vectors}")
+        nlist = nlist or max(1, min(int(4 * math.sqrt(n_vectors)), n_vectors // 39))
+        if pq_m is None:
+            ## largest sub-quantizer count <= 64 that divides the dimension
+            pq_m = max(m for m in range(1, min(64, dimensions) + 1) if dimensions % m == 0)
+        return f"IVF{nlist},PQ{pq_m}"
+    raise ValueError(f"Unknown index type {index_type!r}, choose from {INDEX_TYPES}")
+
+
+def set_search_params(index, nprobe=16, ef_search=64):
+    """Search-time knobs trading recall for latency"""
+    try:
+        faiss.extract_index_ivf(index).nprobe = nprobe
+    except Exception:
+        pass  ## not an IVF index
+    if hasattr(index, "hnsw"):
+        index.hnsw.efSearch = ef_search
+
+
+def build_index(vectors, index_type, metric=faiss.METRIC_L2, nlist=None, pq_m=None, hnsw_m=32,
+                nprobe=16, ef_search=64):
+    """Train (if needed) and fill a FAISS index of `index_type` with `vectors`"""
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    n_vectors, dimensions = vectors.shape
+    index = faiss.index_factory(dimensions,
+                                factory_string(index_type, n_vectors, dimensions, nlist, pq_m, hnsw_m),
+                                metric)
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    set_search_params(index, nprobe, ef_search)
+    return index
+
+
+def flat_vectors(vectorstore):
+    """All vectors of a flat LangChain FAISS store, in index order"""
+    return vectorstore.index.reconstruct_n(0, vectorstore.index.ntotal)
+
+
+def convert_vectorstore(vectorstore, index_type, **kwargs):
+    """Rebuild a flat LangChain FAISS store with another index type (same docstore and ids)"""
+    index = build_index(flat_vectors(vectorstore), index_type,
+                        metric=vectorstore.index.metric_type, **kwargs)
+    return FAISS(
+        embedding_function=vectorstore.embedding_function,
+        index=index,
+        docstore=vectorstore.docstore,
+        index_to_docstore_id=dict(vectorstore.index_to_docstore_id),
+        distance_strategy=vectorstore.distance_strategy,
+    )
+
+
+#### Recall vs latency report
+def _timed_search(index, queries, k):
+    latencies = []
+    results = []
+    for q in queries:
+        start = time.perf_counter()
+        _, ids = index.search(q.reshape(1, -1), k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append(ids[0])
+    return np.array(results), np.array(latencies)
+
+
+def recall_latency_report(flat_index, candidate_index, queries=None, k=5, n_queries=200, seed=0):
+    """Compare a candidate index against the exact flat index.
+
+    Queries default to a random sample of the stored vectors. Returns a dict with
+    recall@k, p50/p95 single-query latency (ms) and serialized size (bytes) of both.
+    """
+    if queries is None:
+        rng = np.random.default_rng(seed)
+        ids = rng.choice(flat_index.ntotal, size=min(n_queries, flat_index.ntotal), replace=False)
+        queries = np.vstack([flat_index.reconstruct(int(i)) for i in ids])
+    queries = np.ascontiguousarray(queries, dtype="float32")
+
+    truth, flat_ms = _timed_search(flat_index, queries, k)
+    found, cand_ms = _timed_search(candidate_index, queries, k)
+    recall = np.mean([len(set(t[t >= 0]) & set(f[f >= 0])) / max(1, len(t[t >= 0]))
+                      for t, f in zip(truth, found)])
+    return {
+        "k": k,
+        "queries": len(queries),
+        "recall_at_k": float(recall),
+        "flat_p50_ms": float(np.percentile(flat_ms, 50)),
+        "flat_p95_ms": float(np.percentile(flat_ms, 95)),
+        "candidate_p50_ms": float(np.percentile(cand_ms, 50)),
+        "candidate_p95_ms": float(np.percentile(cand_ms, 95)),
+        "flat_bytes": int(faiss.serialize_index(flat_index).nbytes),
+        "candidate_bytes": int(faiss.serialize_index(candidate_index).nbytes),
+    }
+
+
+def build_serving_index(index_dir, embeddings, index_type, report=True, **kwargs):
+    """Build the `index_type` index from the flat index on disk, save it and optionally report"""
+    flat = FAISS.load_local(index_dir, embeddings, allow_dangerous_deserialization=True)
+    if index_type == "flat":
+        return flat, None
+    vectorstore = convert_vectorstore(flat, index_type, **kwargs)
+    vectorstore.save_local(serving_index_dir(index_dir, index_type))
+    return vectorstore, recall_latency_report(flat.index, vectorstore.index) if report else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--index-dir', type=str, default='faiss_index')
+    parser.add_argument('--index-type', type=str, default='hnsw', choices=INDEX_TYPES)
+    parser.add_argument('--nlist', type=int, default=None)
+    parser.add_argument('--pq-m', type=int, default=None)
+    parser.add_argument('--hnsw-m', type=int, default=32)
+    parser.add_argument('--nprobe', type=int, default=16)
+    parser.add_argument('--ef-search', type=int, default=64)
+    parser.add_argument('--k', type=int, default=5)
+    args = parser.parse_args()
+
+    flat = faiss.read_index(f"{args.index_dir}/index.faiss")
+    candidate = build_index(flat.reconstruct_n(0, flat.ntotal), args.index_type, metric=flat.metric_type,
+                            nlist=args.nlist, pq_m=args.pq_m, hnsw_m=args.hnsw_m,
+                            nprobe=args.nprobe, ef_search=args.ef_search)
+    for key, value in recall_latency_report(flat, candidate, k=args.k).items():
+        print(f"{key}: {value}")
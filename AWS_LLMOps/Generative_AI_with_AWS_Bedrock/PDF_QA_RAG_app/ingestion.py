@@ -0,0 +1,238 @@
+## Incremental ingestion for the PDF QA RAG app
+## Keeps a manifest of per-file and per-chunk content hashes next to the FAISS index
+## so that "Vectors Update" only embeds new/changed chunks and drops vectors of deleted files.
+import hashlib
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_community.document_loaders import PyPDFLoader
+from langchain_community.vectorstores import FAISS
+
+MANIFEST_FILE = "manifest.json"
+MANIFEST_VERSION = 1
+
+
+#### Hashing helpers
+def file_sha256(path, block_size=1 << 20):
+    """Content hash of a file on disk"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def text_sha256(text):
+    """Content hash of a chunk of text"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def list_pdfs(data_dir):
+    """Relative paths of all PDF files under the data folder"""
+    paths = []
+    for root, _, files in os.walk(data_dir):
+        for name in files:
+            if name.lower().endswith(".pdf"):
+                paths.append(os.path.relpath(os.path.join(root, name), data_dir))
+    return sorted(paths)
+
+
+#### Manifest
+def empty_manifest(chunk_size, chunk_overlap):
+    return {
+        "version": MANIFEST_VERSION,
+        "chunk_size": chunk_size,
+        "chunk_overlap": chunk_overlap,
+        "files": {},
+    }
+
+
+def load_manifest(index_dir):
+    """Load the ingestion manifest stored next to the index (None if missing)"""
+    path = os.path.join(index_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(index_dir, manifest):
+    """Write the manifest atomically so a crash never leaves a half written file"""
+    os.makedirs(index_dir, exist_ok=True)
+    path = os.path.join(index_dir, MANIFEST_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def clear_manifest(index_dir):
+    """Forget the manifest (after a full rebuild the chunk ids no longer match it)"""
+    path = os.path.join(index_dir, MANIFEST_FILE)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+#### Chunking
+def split_pdf(path, rel_path, text_splitter):
+    """Load and split a single PDF, tagging each chunk with its hash and a stable id"""
+    documents = PyPDFLoader(path).load()
+    chunks = text_splitter.split_documents(documents)
+    seen = {}
+    for chunk in chunks:
+        chunk_hash = text_sha256(chunk.page_content)
+        ## identical chunks inside one file still need distinct ids
+        occurrence = seen.get(chunk_hash, 0)
+        seen[chunk_hash] = occurrence + 1
+        chunk.metadata["source"] = rel_path
+        chunk.metadata["chunk_hash"] = chunk_hash
+        chunk.metadata["chunk_id"] = text_sha256(f"{rel_path}\0{chunk_hash}\0{occurrence}")
+    return chunks
+
+
+def _split_worker(data_dir, rel_path, chunk_size, chunk_overlap):
+    """Runs in a worker process: parse + split one PDF"""
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size,
+                                                   chunk_overlap=chunk_overlap)
+    return rel_path, split_pdf(os.path.join(data_dir, rel_path), rel_path, text_splitter)
+
+
+def iter_split_files(data_dir, rel_paths=None, chunk_size=10000, chunk_overlap=1000,
+                     max_workers=None, max_in_flight=None):
+    """Parse and split PDFs over a process pool, yielding (rel_path, chunks) as each file finishes.
+
+    At most `max_in_flight` files are parsed or waiting to be consumed at any time,
+    which bounds peak memory independently of the corpus size. Files are yielded
+    in completion order, not in `rel_paths` order.
+    """
+    if rel_paths is None:
+        rel_paths = list_pdfs(data_dir)
+    max_workers = max_workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or 2 * max_workers
+
+    pending_paths = iter(rel_paths)
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        in_flight = set()
+        for rel in pending_paths:
+            in_flight.add(pool.submit(_split_worker, data_dir, rel, chunk_size, chunk_overlap))
+            if len(in_flight) >= max_in_flight:
+                break
+        while in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            ## refill before yielding so parsing keeps going while the consumer embeds
+            for rel in pending_paths:
+                in_flight.add(pool.submit(_split_worker, data_dir, rel, chunk_size, chunk_overlap))
+                if len(in_flight) >= max_in_flight:
+                    break
+            for future in done:
+                yield future.result()
+
+
+def iter_chunks(data_dir, chunk_size=10000, chunk_overlap=1000, max_workers=None, max_in_flight=None):
+    """Streaming replacement for PyPDFDirectoryLoader(...).load() + split_documents"""
+    for _, chunks in iter_split_files(data_dir, None, chunk_size, chunk_overlap,
+                                      max_workers, max_in_flight):
+        yield from chunks
+
+
+def add_documents_in_batches(vectorstore, docs, embeddings, batch_size=256, ids_from_metadata=True):
+    """Embed an iterable of chunks batch by batch, creating the FAISS store on the first batch"""
+    batch = []
+
+    def flush(store):
+        ids = [d.metadata["chunk_id"] for d in batch] if ids_from_metadata else None
+        if store is None:
+            store = FAISS.from_documents(batch, embeddings, ids=ids)
+        else:
+            store.add_documents(batch, ids=ids)
+        batch.clear()
+        return store
+
+    for doc in docs:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            vectorstore = flush(vectorstore)
+    if batch:
+        vectorstore = flush(vectorstore)
+    return vectorstore
+
+
+def plan_update(data_dir, manifest):
+    """Compare the data folder against the manifest.
+
+    Returns (new_or_changed, deleted, file_hashes) where `new_or_changed` and
+    `deleted` are lists of relative paths.
+    """
+    file_hashes = {rel: file_sha256(os.path.join(data_dir, rel)) for rel in list_pdfs(data_dir)}
+    known = manifest["files"]
+    new_or_changed = [rel for rel, h in file_hashes.items() if known.get(rel, {}).get("sha256") != h]
+    deleted = [rel for rel in known if rel not in file_hashes]
+    return new_or_changed, deleted, file_hashes
+
+
+#### Incremental update
+def incremental_update(data_dir, index_dir, embeddings, chunk_size=10000, chunk_overlap=1000,
+                       max_workers=None, max_in_flight=None):
+    """Bring the FAISS index in `index_dir` in sync with the PDFs in `data_dir`.
+
+    Only chunks whose content hash is not already in the index are embedded,
+    vectors of removed chunks/files are deleted and the result is merged into
+    the index on disk. Returns (vectorstore, stats).
+    """
+    manifest = load_manifest(index_dir)
+    vectorstore = None
+    if (manifest is not None
+            and manifest.get("version") == MANIFEST_VERSION
+            and manifest.get("chunk_size") == chunk_size
+            and manifest.get("chunk_overlap") == chunk_overlap):
+        vectorstore = FAISS.load_local(index_dir, embeddings, allow_dangerous_deserialization=True)
+    else:
+        ## no manifest or different chunking settings -> everything is new
+        manifest = empty_manifest(chunk_size, chunk_overlap)
+
+    new_or_changed, deleted, file_hashes = plan_update(data_dir, manifest)
+
+    stats = {"files_added_or_changed": len(new_or_changed), "files_deleted": len(deleted),
+             "chunks_embedded": 0, "chunks_reused": 0, "chunks_deleted": 0}
+
+    ## chunk ids to drop: every chunk of a deleted file
+    stale_ids = set()
+    for rel in deleted:
+        stale_ids.update(manifest["files"][rel]["chunks"])
+        del manifest["files"][rel]
+
+    ## new or changed files: only embed chunks not already in the index.
+    ## Files are parsed in parallel and their chunks embedded as soon as they arrive.
+    indexed_ids = set(vectorstore.index_to_docstore_id.values()) if vectorstore is not None else set()
+
+    def new_chunks():
+        for rel, chunks in iter_split_files(data_dir, new_or_changed, chunk_size, chunk_overlap,
+                                            max_workers, max_in_flight):
+            old_ids = set(manifest["files"].get(rel, {}).get("chunks", []))
+            new_ids = [c.metadata["chunk_id"] for c in chunks]
+            for chunk in chunks:
+                if chunk.metadata["chunk_id"] in indexed_ids:
+                    stats["chunks_reused"] += 1
+                else:
+                    stats["chunks_embedded"] += 1
+                    yield chunk
+            stale_ids.update(old_ids.difference(new_ids))
+            manifest["files"][rel] = {"sha256": file_hashes[rel], "chunks": new_ids}
+
+    vectorstore = add_documents_in_batches(vectorstore, new_chunks(), embeddings)
+
+    stale_ids.intersection_update(indexed_ids)
+    if stale_ids:
+        vectorstore.delete(list(stale_ids))
+        stats["chunks_deleted"] = len(stale_ids)
+
+    if vectorstore is None:
+        raise ValueError(f"No PDF files found in {data_dir}")
+
+    ## index first, then manifest: after a crash in between the next run finds
+    ## the chunk ids already in the index and only repairs the manifest
+    vectorstore.save_local(index_dir)
+    save_manifest(index_dir, manifest)
+    return vectorstore, stats
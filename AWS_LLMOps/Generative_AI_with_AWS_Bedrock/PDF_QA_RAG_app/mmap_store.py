@@ -0,0 +1,230 @@
+## Memory-mapped, pickle-free on-disk format for the PDF QA RAG app
+## A store path is a symlink to the current version folder `<path>.v<n>`, switched atomically
+## by write_store(). Layout of a version folder:
+##   meta.json                    -- format version, count, dimensions, metric
+##   vectors.f32                  -- (n, d) float32 matrix, row i = chunk i
+##   norms.f32                    -- (n,) squared L2 norms for fast L2 search
+##   ids|text|metadata.bin        -- utf-8 column data, rows concatenated
+##   ids|text|metadata.offsets    -- (n + 1,) int64 byte offsets into the .bin file
+##   index.faiss (optional)       -- approximate FAISS index over the same rows
+## Everything is opened with np.memmap, so loading is near-instant, pages are faulted
+## in lazily and several app worker processes share the same physical pages.
+import json
+import os
+import shutil
+import time
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+FORMAT_VERSION = 1
+COLUMNS = ("ids", "text", "metadata")
+
+
+#### Writing
+def _write_column(path, name, values):
+    offsets = np.zeros(len(values) + 1, dtype="int64")
+    with open(os.path.join(path, f"{name}.bin"), "wb") as f:
+        for i, value in enumerate(values):
+            data = value.encode("utf-8")
+            f.write(data)
+            offsets[i + 1] = offsets[i] + len(data)
+    offsets.tofile(os.path.join(path, f"{name}.offsets"))
+
+
+def _versions(path):
+    """Version folders of a store, oldest first"""
+    folder, name = os.path.split(os.path.abspath(path))
+    versions = []
+    for entry in os.listdir(folder):
+        suffix = entry[len(name) + 2:] if entry.startswith(name + ".v") else ""
+        if suffix.isdigit():
+            versions.append((int(suffix), os.path.join(folder, entry)))
+    return [version_path for _, version_path in sorted(versions)]
+
+
+def write_store(path, vectors, ids, texts, metadatas, metric="l2", index=None, keep_versions=2):
+    """Write a new version of the store and switch `path` to it atomically.
+
+    The data goes to a fresh `<path>.v<n>` folder; `path` is a symlink that is replaced in
+    one os.replace, so it exists at every moment and readers see either the old or the new
+    version. The last `keep_versions` versions are kept for readers still opening them.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    version_path = f"{path}.v{time.time_ns()}"
+    os.makedirs(version_path)
+
+    vectors.tofile(os.path.join(version_path, "vectors.f32"))
+    np.einsum("ij,ij->i", vectors, vectors).astype("float32").tofile(os.path.join(version_path, "norms.f32"))
+    _write_column(version_path, "ids", ids)
+    _write_column(version_path, "text", texts)
+    _write_column(version_path, "metadata", [json.dumps(m, default=str) for m in metadatas])
+    if index is not None:
+        faiss.write_index(index, os.path.join(version_path, "index.faiss"))
+    with open(os.path.join(version_path, "meta.json"), "w") as f:
+        json.dump({"version": FORMAT_VERSION, "count": int(vectors.shape[0]),
+                   "dimensions": int(vectors.shape[1]), "metric": metric}, f)
+
+    if os.path.isdir(path) and not os.path.islink(path):
+        ## a store written before versioning: move it aside once (it becomes the oldest version)
+        os.rename(path, f"{path}.v0")
+    link_path = path + ".link.tmp"
+    if os.path.lexists(link_path):
+        os.remove(link_path)
+    ## relative target, so the store can be copied/moved together with its versions
+    os.symlink(os.path.basename(version_path), link_path)
+    os.replace(link_path, path)
+    for old_path in _versions(path)[:-keep_versions]:
+        shutil.rmtree(old_path, ignore_errors=True)
+
+
+def export_faiss_store(vectorstore, path, index=None):
+    """Convert a (flat) LangChain FAISS store into the memory-mapped format.
+
+    `index` is an optional approximate FAISS index over the same rows (see index_options.py).
+    """
+    flat = vectorstore.index
+    vectors = flat.reconstruct_n(0, flat.ntotal)
+    ids = [vectorstore.index_to_docstore_id[i] for i in range(flat.ntotal)]
+    docs = [vectorstore.docstore.search(doc_id) for doc_id in ids]
+    metric = "ip" if flat.metric_type == faiss.METRIC_INNER_PRODUCT else "l2"
+    write_store(path, vectors, ids, [d.page_content for d in docs], [d.metadata for d in docs],
+                metric=metric, index=index)
+
+
+#### Reading
+class _Column:
+    """Lazily decoded string column backed by memory-mapped data + offsets"""
+
+    def __init__(self, path, name):
+        self.offsets = np.memmap(os.path.join(path, f"{name}.offsets"), dtype="int64", mode="r")
+        data_path = os.path.join(path, f"{name}.bin")
+        ## np.memmap refuses empty files
+        self.data = (np.memmap(data_path, dtype="uint8", mode="r")
+                     if os.path.getsize(data_path) else np.zeros(0, dtype="uint8"))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("utf-8")
+
+
+class MmapVectorStore(VectorStore):
+    """Read-only LangChain vector store over a memory-mapped store folder.
+
+    Without an `index.faiss` the search is an exact blocked scan over the mapped
+    vectors, so memory use is bounded by `block_size` rows regardless of corpus size.
+    """
+
+    def __init__(self, path, embedding, block_size=65536, mmap_index=True):
+        ## resolve the symlink once, so every file below comes from the same version
+        path = os.path.realpath(path)
+        self.path = path
+        self.embedding = embedding
+        self.block_size = block_size
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta["version"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported store format version {self.meta['version']}")
+        n, d = self.meta["count"], self.meta["dimensions"]
+        self.metric = self.meta["metric"]
+        self.vectors = (np.memmap(os.path.join(path, "vectors.f32"), dtype="float32", mode="r", shape=(n, d))
+                        if n else np.zeros((0, d), dtype="float32"))
+        self.norms = (np.memmap(os.path.join(path, "norms.f32"), dtype="float32", mode="r")
+                      if n else np.zeros(0, dtype="float32"))
+        self.columns = {name: _Column(path, name) for name in COLUMNS}
+        self.index = None
+        index_path = os.path.join(path, "index.faiss")
+        if os.path.exists(index_path):
+            flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if mmap_index else 0
+            self.index = faiss.read_index(index_path, flags)
+
+    @classmethod
+    def load(cls, path, embedding, retries=3, **kwargs):
+        for attempt in range(retries):
+            try:
+                return cls(path, embedding, **kwargs)
+            except FileNotFoundError:
+                ## the version we resolved was removed by newer writes meanwhile -- resolve the link again
+                if attempt == retries - 1:
+                    raise
+
+    @property
+    def embeddings(self):
+        return self.embedding
+
+    def __len__(self):
+        return self.meta["count"]
+
+    def get_id(self, i):
+        return self.columns["ids"][i]
+
+    def get_document(self, i):
+        return Document(page_content=self.columns["text"][i],
+                        metadata=json.loads(self.columns["metadata"][i]))
+
+    #### search
+    def _scan(self, query, k):
+        """Exact search over the mapped vectors block by block"""
+        best_scores = np.empty(0, dtype="float32")
+        best_rows = np.empty(0, dtype="int64")
+        q_norm = float(query @ query)
+        for start in range(0, len(self), self.block_size):
+            block = self.vectors[start:start + self.block_size]
+            dots = block @ query
+            if self.metric == "ip":
+                scores = -dots  ## sort ascending either way
+            else:
+                scores = self.norms[start:start + self.block_size] - 2 * dots + q_norm
+            top = np.argpartition(scores, min(k, len(scores) - 1))[:k]
+            best_scores = np.concatenate([best_scores, scores[top]])
+            best_rows = np.concatenate([best_rows, top + start])
+            keep = np.argsort(best_scores, kind="stable")[:k]
+            best_scores, best_rows = best_scores[keep], best_rows[keep]
+        if self.metric == "ip":
+            best_scores = -best_scores
+        return best_rows, best_scores
+
+    def search_vector(self, embedding, k=4):
+        """Row numbers and scores (squared L2 distance, or inner product) of the k nearest chunks"""
+        query = np.asarray(embedding, dtype="float32")
+        if len(self) == 0:
+            return np.empty(0, dtype="int64"), np.empty(0, dtype="float32")
+        if self.index is not None:
+            scores, rows = self.index.search(query.reshape(1, -1), k)
+            keep = rows[0] >= 0
+            return rows[0][keep], scores[0][keep]
+        return self._scan(query, k)
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, **kwargs):
+        rows, scores = self.search_vector(embedding, k)
+        return [(self.get_document(int(r)), float(s)) for r, s in zip(rows, scores)]
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_with_score_by_vector(self.embedding.embed_query(query), k)
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k)]
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def _select_relevance_score_fn(self):
+        if self.metric == "ip":
+            return self._max_inner_product_relevance_score_fn
+        return self._euclidean_relevance_score_fn
+
+    #### read-only
+    def add_texts(self, texts, metadatas=None, **kwargs):
+        raise NotImplementedError("MmapVectorStore is read-only, rebuild it with export_faiss_store()")
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, path="faiss_index_mmap", **kwargs):
+        texts = list(texts)
+        vectors = np.asarray(embedding.embed_documents(texts), dtype="float32")
+        ids = ids or [str(i) for i in range(len(texts))]
+        write_store(path, vectors, ids, texts, metadatas or [{} for _ in texts])
+        return cls(path, embedding)
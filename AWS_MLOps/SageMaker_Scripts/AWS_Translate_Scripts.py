@@ -20,7 +20,9 @@
 }
 ### Code below is to use when NOT using translation accuracy metrics
 import boto3
+import numpy as np
 import pandas as pd
+from tqdm import tqdm
 
 # Set up the AWS Translate client
 translate = boto3.client('translate', region_name='your-region')
@@ -37,11 +39,27 @@ def translate_text(text, source_lang='auto', target_lang='en'):
          print(f"Error translating text: {e}")
          return text  # Return original text if translation fails
 
+## Dedupe-and-fanout: chat data repeats a lot ("ok thanks"), so translate each unique
+## (case/whitespace-normalized) message once and scatter the result back to every matching row
+## `batch=True`: func takes the list of unique values and returns their results (e.g. TranslationEngine below)
+def apply_unique(series, func, desc="Translating", batch=False):
+    ## whitespace-only normalization (like TranslationMemory.text_hash): case variants are different
+    ## messages, and pass-through results (e.g. English rows) carry the row's own text
+    keys = series.fillna('').astype(str).str.split().str.join(' ')
+    codes, uniques = pd.factorize(keys)
+    first_rows = np.unique(codes, return_index=True)[1]  ## first row of each unique value, in code order
+    if batch:
+        results = func(list(series.iloc[first_rows]))
+    else:
+        results = [func(text) for text in tqdm(series.iloc[first_rows], desc=desc)]
+    print(f"Dedup: {len(uniques)} unique of {len(series)} rows ({1 - len(uniques) / max(len(series), 1):.1%} of calls saved)")
+    return pd.Series([results[code] for code in codes], index=series.index)
+
 ## Load your DataFrame
  df = pd.read_csv('your_data.csv')  
 
 ## Apply translation to a specific column
-df['translated_column'] = df['text_column'].apply(translate_text)
+df['translated_column'] = apply_unique(df['text_column'], translate_text)
 
 ## Save the updated DataFrame if needed
 df.to_csv('translated_data.csv', index=False)
@@ -59,50 +77,641 @@ from tqdm import tqdm
 translate = boto3.client('translate', region_name='<your region here>')
 
 ## translate text function -- change `source_lang` based on your data
-def translate_text(text, source_lang='auto', target_lang='en'):
+## `memory` is an optional TranslationMemory (see below): cached translations are returned without an API call
+def translate_text(text, source_lang='auto', target_lang='en', memory=None):
+    if not isinstance(text, str):  ## NaN / None messages are passed through untranslated
+        return {'translated_text': text, 'source_language': None, 'confidence_score': None}
     try:
+        if memory is not None:
+            cached = memory.get(text, source_lang, target_lang)
+            if cached is not None:
+                return cached
         response = translate.translate_text(
             Text=text,
             SourceLanguageCode=source_lang,
             TargetLanguageCode=target_lang
         )
-        return {
+        result = {
             'translated_text': response['TranslatedText'],
             'source_language': response['SourceLanguageCode'],
             'confidence_score': response.get('TranslationConfidence', {}).get('Score')
         }
+        if memory is not None:
+            memory.put(text, result, source_lang, target_lang)
+        return result
     except Exception as e:
         print(f"Error translating text: {e}")
         return {'translated_text': text, 'source_language': None, 'confidence_score': None}
 
-# Apply translation to a specific column and expand the result with tqdm progress_bar
-tqdm.pandas(desc="Translating")
-df_translate[['translated_column', 'detected_source_language', 'confidence_score']] = df_translate['message'].progress_apply(translate_text).apply(pd.Series)
+# Apply translation to a specific column (once per unique message, see apply_unique above) and expand the result
+df_translate[['translated_column', 'detected_source_language', 'confidence_score']] = apply_unique(df_translate['message'], translate_text).apply(pd.Series)
 
 # Save the updated DataFrame if needed
 df_translate.to_csv('translated_data_with_metrics.csv', index=False)
 
 
 
+### Concurrent, batched translation for large datasets
+## One synchronous call per row takes days for a million messages. TranslationEngine keeps a bounded
+## pool of requests in flight, packs short messages of the same source language into one request
+## (one message per line, up to `max_bytes`), retries throttled calls with jittered exponential backoff
+## and returns the results in input order. StubTranslateClient stands in for the API in local tests.
+## LanguageDetector (below) runs first so packs get real source codes and English rows skip translation.
+import hashlib
+import os
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import boto3
+import pandas as pd
+from botocore.config import Config
+from tqdm import tqdm
+
+THROTTLING_CODES = {"ThrottlingException", "TooManyRequestsException", "ServiceUnavailableException",
+                    "LimitExceededException"}
+
+def is_throttling_error(exc):
+    response = getattr(exc, "response", None)
+    return isinstance(response, dict) and response.get("Error", {}).get("Code") in THROTTLING_CODES
+
+def call_with_backoff(fn, max_retries=8, base_delay=0.5, max_delay=30.0, on_throttle=None):
+    """Call `fn`, retrying throttling errors with full-jitter exponential backoff"""
+    for attempt in range(max_retries + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if not is_throttling_error(e) or attempt == max_retries:
+                raise
+            if on_throttle is not None:
+                on_throttle()
+            time.sleep(random.uniform(0, min(max_delay, base_delay * 2 ** attempt)))
+
+class TranslationMemory:
+    """On-disk translation memory: one SQLite file (WAL mode) keyed on (source, target, normalized text hash).
+
+    Detected languages are kept per normalized text as well (get_languages/put_languages),
+    so a rerun skips Comprehend for messages it has seen before.
+
+    Threads share one connection behind a lock; worker processes can open the same
+    file (writers wait for the lock up to `timeout` seconds). Least-recently-used
+    entries beyond `max_entries` are evicted on put; compact() also gives the freed
+    space back to the file. Call close() (or save_copy()) before shipping the file
+    to another job.
+    """
+
+    def __init__(self, path='translation_memory.sqlite', max_entries=5_000_000, timeout=60):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=timeout)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS translations (
+                   source_lang TEXT NOT NULL,
+                   target_lang TEXT NOT NULL,
+                   text_hash TEXT NOT NULL,
+                   translated_text TEXT NOT NULL,
+                   detected_lang TEXT,
+                   confidence_score REAL,
+                   last_used REAL NOT NULL,
+                   PRIMARY KEY (source_lang, target_lang, text_hash))"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON translations (last_used)")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS detections (
+                   text_hash TEXT PRIMARY KEY,
+                   language TEXT NOT NULL,
+                   score REAL,
+                   last_used REAL NOT NULL)"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_detections_last_used ON detections (last_used)")
+        self._conn.commit()
+        ## upper bound of the entry count per table (replaced rows are counted twice), recounted before evicting
+        self._counts = {table: self._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                        for table in ('translations', 'detections')}
+
+    @staticmethod
+    def text_hash(text):
+        return hashlib.sha256(" ".join(text.split()).encode('utf-8')).hexdigest()
+
+    def get_many(self, texts, source_langs, target_lang):
+        """Cached results (same shape as translate_text) or None, in input order"""
+        keys = [(source_lang, self.text_hash(text)) for text, source_lang in zip(texts, source_langs)]
+        by_source = {}
+        for source_lang, text_hash in set(keys):
+            by_source.setdefault(source_lang, []).append(text_hash)
+        found = {}
+        with self._lock:
+            for source_lang, hashes in by_source.items():
+                ## sqlite limits the number of bound parameters per statement
+                for i in range(0, len(hashes), 500):
+                    part = hashes[i:i + 500]
+                    rows = self._conn.execute(
+                        f"SELECT text_hash, translated_text, detected_lang, confidence_score FROM translations "
+                        f"WHERE source_lang = ? AND target_lang = ? AND text_hash IN ({','.join('?' * len(part))})",
+                        [source_lang, target_lang, *part]).fetchall()
+                    for text_hash, translated_text, detected_lang, confidence_score in rows:
+                        found[(source_lang, text_hash)] = {'translated_text': translated_text,
+                                                           'source_language': detected_lang,
+                                                           'confidence_score': confidence_score}
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE translations SET last_used = ? WHERE source_lang = ? AND target_lang = ? AND text_hash = ?",
+                    [(now, source_lang, target_lang, text_hash) for source_lang, text_hash in found])
+                self._conn.commit()
+        results = [found.get(key) for key in keys]
+        hits = sum(result is not None for result in results)
+        self.hits += hits
+        self.misses += len(results) - hits
+        return results
+
+    def put_many(self, texts, source_langs, target_lang, results):
+        """Store translate_text-shaped results (failed translations, with no source language, are skipped)"""
+        now = time.time()
+        rows = [(source_lang, target_lang, self.text_hash(text), result['translated_text'],
+                 result['source_language'], result['confidence_score'], now)
+                for text, source_lang, result in zip(texts, source_langs, results)
+                if result is not None and result['source_language'] is not None]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self._counts['translations'] += len(rows)
+            if self._counts['translations'] > self.max_entries:
+                self._evict('translations')
+            self._conn.commit()
+
+    def _evict(self, table):
+        """Delete least-recently-used entries of `table` beyond max_entries (caller holds the lock)"""
+        (count,) = self._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()
+        if count > self.max_entries:
+            self._conn.execute(f"DELETE FROM {table} WHERE rowid IN "
+                               f"(SELECT rowid FROM {table} ORDER BY last_used LIMIT ?)",
+                               (count - self.max_entries,))
+            count = self.max_entries
+        self._counts[table] = count
+
+    def get(self, text, source_lang='auto', target_lang='en'):
+        return self.get_many([text], [source_lang], target_lang)[0]
+
+    def put(self, text, result, source_lang='auto', target_lang='en'):
+        self.put_many([text], [source_lang], target_lang, [result])
+
+    def get_languages(self, texts):
+        """Cached (language code, score) per text or None, in input order"""
+        keys = [self.text_hash(text) for text in texts]
+        unique = list(set(keys))
+        found = {}
+        with self._lock:
+            for i in range(0, len(unique), 500):
+                part = unique[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT text_hash, language, score FROM detections WHERE text_hash IN ({','.join('?' * len(part))})",
+                    part).fetchall()
+                for text_hash, language, score in rows:
+                    found[text_hash] = (language, score)
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE detections SET last_used = ? WHERE text_hash = ?",
+                                       [(now, text_hash) for text_hash in found])
+                self._conn.commit()
+        return [found.get(key) for key in keys]
+
+    def put_languages(self, texts, detected):
+        """Store (language code, score) pairs; failed detections ('auto') are skipped"""
+        now = time.time()
+        rows = [(self.text_hash(text), language, score, now)
+                for text, (language, score) in zip(texts, detected) if language != 'auto']
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO detections VALUES (?, ?, ?, ?)", rows)
+            self._counts['detections'] += len(rows)
+            if self._counts['detections'] > self.max_entries:
+                self._evict('detections')
+            self._conn.commit()
+
+    def compact(self):
+        """Evict least-recently-used entries beyond max_entries and give the space back"""
+        with self._lock:
+            self._evict('translations')
+            self._evict('detections')
+            self._conn.commit()
+            self._conn.execute("VACUUM")
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def save_copy(self, dest_path):
+        """Consistent single-file snapshot (no -wal/-shm files) while the memory stays in use"""
+        dest = sqlite3.connect(dest_path)
+        with self._lock:
+            self._conn.backup(dest)
+        dest.execute("PRAGMA journal_mode=DELETE")
+        dest.close()
+
+    def close(self):
+        """Checkpoint the WAL into the main file, which can then be shipped on its own"""
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._conn.close()
+
+class TranslationEngine:
+    """Translate many messages concurrently; results have the same shape as translate_text above"""
+
+    def __init__(self, client, max_workers=16, max_bytes=9000, max_messages=50, max_retries=8,
+                 base_delay=0.5, max_delay=30.0, pack_auto=False, memory=None):
+        self.client = client
+        self.memory = memory                ## optional TranslationMemory consulted before the API
+        self.max_workers = max_workers
+        self.max_bytes = max_bytes          ## TranslateText accepts up to 10,000 bytes of UTF-8
+        self.max_messages = max_messages
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.pack_auto = pack_auto          ## with 'auto', one detected language is applied to the whole pack
+        self.stats = {"requests": 0, "throttled": 0, "unpacked": 0, "errors": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def _call(self, text, source_lang, target_lang):
+        """One TranslateText call, retried with full-jitter backoff while throttled"""
+        def call():
+            self._count("requests")
+            return self.client.translate_text(Text=text, SourceLanguageCode=source_lang, TargetLanguageCode=target_lang)
+        return call_with_backoff(call, self.max_retries, self.base_delay, self.max_delay,
+                                 on_throttle=lambda: self._count("throttled"))
+
+    @staticmethod
+    def _result(response, text):
+        if response is None:
+            return {'translated_text': text, 'source_language': None, 'confidence_score': None}
+        return {'translated_text': response['TranslatedText'],
+                'source_language': response['SourceLanguageCode'],
+                'confidence_score': response.get('TranslationConfidence', {}).get('Score')}
+
+    def _translate_one(self, text, source_lang, target_lang):
+        try:
+            return self._result(self._call(text, source_lang, target_lang), text)
+        except Exception as e:
+            print(f"Error translating text: {e}")
+            self._count("errors")
+            return self._result(None, text)
+
+    def _translate_pack(self, texts, source_lang, target_lang):
+        """Translate a pack of single-line messages in one call (falls back to one call each)"""
+        if len(texts) == 1:
+            return [self._translate_one(texts[0], source_lang, target_lang)]
+        try:
+            response = self._call("\n".join(texts), source_lang, target_lang)
+            lines = response['TranslatedText'].split("\n")
+            if len(lines) == len(texts):
+                return [self._result({**response, 'TranslatedText': line}, text) for line, text in zip(lines, texts)]
+        except Exception as e:
+            print(f"Error translating pack, retrying one by one: {e}")
+        ## the translation merged or split lines: translate the messages separately
+        self._count("unpacked", len(texts))
+        return [self._translate_one(text, source_lang, target_lang) for text in texts]
+
+    def _packs(self, texts, source_langs, todo):
+        """(indices, source language) packs of the `todo` indices; multi-line and 'auto' messages go alone"""
+        open_packs = {}  ## source language -> (indices, bytes)
+        for i in todo:
+            text, source_lang = texts[i], source_langs[i]
+            size = len(text.encode('utf-8'))
+            if "\n" in text or size > self.max_bytes or (source_lang == 'auto' and not self.pack_auto):
+                yield [i], source_lang
+                continue
+            indices, used = open_packs.get(source_lang, ([], 0))
+            if indices and (used + 1 + size > self.max_bytes or len(indices) >= self.max_messages):
+                yield indices, source_lang
+                indices, used = [], 0
+            open_packs[source_lang] = (indices + [i], used + size + (1 if indices else 0))
+        for source_lang, (indices, _) in open_packs.items():
+            if indices:
+                yield indices, source_lang
+
+    def translate_many(self, texts, source_langs='auto', target_lang='en', desc="Translating"):
+        """Translate `texts` (source language per text or one for all); results in input order"""
+        texts = ["" if pd.isna(text) else str(text) for text in texts]
+        source_langs = [source_langs] * len(texts) if isinstance(source_langs, str) else list(source_langs)
+        results = [self._result(None, text) if not text.strip() else None for text in texts]
+        todo = [i for i, result in enumerate(results) if result is None]
+        if self.memory is not None and todo:
+            cached = self.memory.get_many([texts[i] for i in todo], [source_langs[i] for i in todo], target_lang)
+            for i, result in zip(todo, cached):
+                results[i] = result
+            todo = [i for i in todo if results[i] is None]
+            print(f"Translation memory: {len(cached) - len(todo)} of {len(cached)} messages already translated")
+        progress = tqdm(total=len(todo), desc=desc)
+        ## a sliding window of in-flight requests keeps memory flat for any input size
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            pending = {}
+            for indices, source_lang in self._packs(texts, source_langs, todo):
+                if len(pending) >= 2 * self.max_workers:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self._collect(future, pending.pop(future), texts, source_langs, target_lang, results, progress)
+                future = pool.submit(self._translate_pack, [texts[i] for i in indices], source_lang, target_lang)
+                pending[future] = indices
+            for future in list(pending):
+                self._collect(future, pending.pop(future), texts, source_langs, target_lang, results, progress)
+        progress.close()
+        return results
+
+    def _collect(self, future, indices, texts, source_langs, target_lang, results, progress):
+        translated = future.result()
+        for i, result in zip(indices, translated):
+            results[i] = result
+        ## stored as packs finish, so an interrupted run keeps what it already paid for
+        if self.memory is not None:
+            self.memory.put_many([texts[i] for i in indices], [source_langs[i] for i in indices], target_lang, translated)
+        progress.update(len(indices))
+
+class StubTranslateClient:
+    """Local stand-in for the translate client: prefixes every line with the target language,
+    sleeps `latency` seconds per call and throttles calls beyond `max_rps` per second"""
+
+    def __init__(self, latency=0.05, max_rps=None):
+        self.latency = latency
+        self.max_rps = max_rps
+        self.calls = 0
+        self._window = []
+        self._lock = threading.Lock()
+
+    def translate_text(self, Text, SourceLanguageCode, TargetLanguageCode, **kwargs):
+        from botocore.exceptions import ClientError
+        with self._lock:
+            now = time.time()
+            self._window = [t for t in self._window if now - t < 1.0]
+            if self.max_rps is not None and len(self._window) >= self.max_rps:
+                raise ClientError({"Error": {"Code": "ThrottlingException", "Message": "Rate exceeded"}}, "TranslateText")
+            self._window.append(now)
+            self.calls += 1
+        time.sleep(self.latency)
+        lines = [f"[{TargetLanguageCode}] {line}" for line in Text.split("\n")]
+        return {'TranslatedText': "\n".join(lines),
+                'SourceLanguageCode': 'es' if SourceLanguageCode == 'auto' else SourceLanguageCode,
+                'TargetLanguageCode': TargetLanguageCode}
+
+### Language detection pre-pass (Comprehend BatchDetectDominantLanguage)
+## Detecting first gives real source codes (needed for the accuracy metrics and for packing), and
+## messages already in the target language skip translation entirely.
+class LanguageDetector:
+    """Detect the dominant language of many messages, 25 per request, several requests in flight.
+
+    With a `memory` (TranslationMemory) languages detected in earlier runs are reused.
+    """
+
+    BATCH_SIZE = 25        ## documents per BatchDetectDominantLanguage request
+    MAX_DOC_BYTES = 5000   ## longer documents are cut (the start is enough to detect the language)
+
+    def __init__(self, client, max_workers=8, min_score=0.5, max_retries=8, base_delay=0.5, max_delay=30.0,
+                 memory=None):
+        self.client = client
+        self.memory = memory
+        self.max_workers = max_workers
+        self.min_score = min_score  ## below this the translate call falls back to 'auto'
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stats = {"requests": 0, "throttled": 0, "errors": 0, "cached": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def _detect_batch(self, texts):
+        """[(language code, score)] for up to 25 texts; ('auto', None) where detection failed"""
+        documents = [text.encode('utf-8')[:self.MAX_DOC_BYTES].decode('utf-8', 'ignore') for text in texts]
+        detected = [('auto', None)] * len(texts)
+        try:
+            self._count("requests")
+            response = call_with_backoff(lambda: self.client.batch_detect_dominant_language(TextList=documents),
+                                         self.max_retries, self.base_delay, self.max_delay,
+                                         on_throttle=lambda: self._count("throttled"))
+        except Exception as e:
+            print(f"Error detecting languages: {e}")
+            self._count("errors", len(texts))
+            return detected
+        for result in response['ResultList']:
+            languages = result.get('Languages') or []
+            if languages:
+                best = max(languages, key=lambda language: language['Score'])
+                if best['Score'] >= self.min_score:
+                    detected[result['Index']] = (best['LanguageCode'], best['Score'])
+        self._count("errors", len(response.get('ErrorList', [])))
+        return detected
+
+    def detect_many(self, texts, desc="Detecting languages"):
+        """[(language code, score)] in input order; empty messages get ('auto', None)"""
+        texts = ["" if pd.isna(text) else str(text) for text in texts]
+        indices = [i for i, text in enumerate(texts) if text.strip()]
+        detected = [('auto', None)] * len(texts)
+        if self.memory is not None and indices:
+            cached = self.memory.get_languages([texts[i] for i in indices])
+            for i, result in zip(indices, cached):
+                if result is not None:
+                    detected[i] = result
+            self._count("cached", sum(result is not None for result in cached))
+            indices = [i for i, result in zip(indices, cached) if result is None]
+        batches = [indices[i:i + self.BATCH_SIZE] for i in range(0, len(indices), self.BATCH_SIZE)]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            ## map keeps the batches in order
+            for batch, results in tqdm(zip(batches, pool.map(lambda b: self._detect_batch([texts[i] for i in b]), batches)),
+                                       total=len(batches), desc=desc):
+                for i, result in zip(batch, results):
+                    detected[i] = result
+                if self.memory is not None:
+                    self.memory.put_languages([texts[i] for i in batch], results)
+        return detected
+
+def detect_and_translate(texts, detector, engine, target_lang='en'):
+    """Detect languages in bulk, keep messages already in `target_lang`, translate the rest with their detected codes"""
+    texts = ["" if pd.isna(text) else str(text) for text in texts]
+    detected = detector.detect_many(texts)
+    results = [None] * len(texts)
+    todo = []
+    for i, (text, (language, score)) in enumerate(zip(texts, detected)):
+        if language == target_lang:
+            results[i] = {'translated_text': text, 'source_language': language, 'confidence_score': None}
+        else:
+            todo.append(i)
+    print(f"Language detection: {len(texts) - len(todo)} of {len(texts)} messages already in '{target_lang}'")
+    translated = engine.translate_many([texts[i] for i in todo], source_langs=[detected[i][0] for i in todo],
+                                       target_lang=target_lang)
+    for i, result in zip(todo, translated):
+        results[i] = result
+    return results
+
+class StubComprehendClient:
+    """Local stand-in for the comprehend client: 'en' for ASCII text with common English words, else 'es'"""
+
+    ENGLISH_WORDS = {"the", "and", "is", "you", "ok", "thanks", "thank", "yes", "no", "please", "hi", "hello"}
+
+    def __init__(self, latency=0.05):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def batch_detect_dominant_language(self, TextList):
+        if len(TextList) > 25:
+            raise ValueError("BatchDetectDominantLanguage accepts at most 25 documents")
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        results = []
+        for i, text in enumerate(TextList):
+            english = text.isascii() and bool(self.ENGLISH_WORDS & set(text.lower().split()))
+            results.append({'Index': i, 'Languages': [{'LanguageCode': 'en' if english else 'es', 'Score': 0.99}]})
+        return {'ResultList': results, 'ErrorList': []}
+
+## Clients with a connection pool large enough for the workers (backoff is done by the engine/detector)
+translate = boto3.client('translate', region_name='<your region here>',
+                         config=Config(max_pool_connections=32, retries={'max_attempts': 1}))
+comprehend = boto3.client('comprehend', region_name='<your region here>',
+                          config=Config(max_pool_connections=8, retries={'max_attempts': 1}))
+## translation memory shared across runs -- copy the file from/to S3 between jobs
+memory = TranslationMemory('translation_memory.sqlite')
+engine = TranslationEngine(translate, max_workers=32, memory=memory)  ## raise with the TPS quota of your account
+detector = LanguageDetector(comprehend, max_workers=8, memory=memory)  ## detected languages are remembered too
+# engine = TranslationEngine(StubTranslateClient(max_rps=200), max_workers=32, memory=memory)  ## local test, no AWS calls
+# detector = LanguageDetector(StubComprehendClient(), max_workers=8, memory=memory)
+
+# Detect, then translate each unique non-English message once (apply_unique with batch=True hands over all of them at once)
+df_translate[['translated_column', 'detected_source_language', 'confidence_score']] = apply_unique(
+    df_translate['message'], lambda texts: detect_and_translate(texts, detector, engine, target_lang='en'), batch=True).apply(pd.Series)
+print(detector.stats, engine.stats, {'memory_hits': memory.hits, 'memory_misses': memory.misses})
+memory.compact()  ## optional: eviction happens on put, this also shrinks the file (VACUUM)
+memory.close()    ## single self-contained file, safe to upload
+
+# Save the updated DataFrame if needed
+df_translate.to_csv('translated_data_with_metrics.csv', index=False)
+
+
 
 #### Filter and Merge Data
 # If you need to merge your original dataframe lets say its called `df_final` with the translation dataframe you used lets say its called `df_translate`.
 # The goal is to take the original message column of only the english messages from the df_final and the translated messages from the "translated_column" in df_translate.
-## This script will help with this merge/join operation
+## This used to be done with the merge/join below; it is replaced by finalize_frame() (next section)
+## and kept only for reference -- don't run it together with finalize_frame.
+
+# # 1. First, merge df_translate back to df_final
+# # Make sure you're merging on the correct column(s) that link these DataFrames
+# df_merged = df_final.merge(df_translate[['message', 'translated_column']], on='message', how='left')
+#
+# # 2. Now create the new column 'final_message_text'
+# df_merged['final_message_text'] = np.where(
+#     df_merged['language_label'] == 'en',
+#     df_merged['message'],  # If English, use original message
+#     df_merged['translated_column']  # If not English, use translated text
+# )
+#
+# # 3. If you want to drop the intermediate columns:
+# df_merged = df_merged.drop(columns=['translated_column'])
+#
+# # 4. If you want to rename df_merged back to df_final:
+# df_final = df_merged
+
+
+#### Faster finalize for large frames
+## The merge above joins on the full message string, copies the whole frame several times (merge,
+## np.where, drop) and multiplies rows when df_translate holds the same message more than once.
+## finalize_frame() looks up only the non-English rows, fills `final_message_text` in one column
+## write, one partition of rows at a time, and keeps one row per df_final row. The fastest key is a
+## 64-bit message hash computed once when the frames are built (text_hash64 -> `message_hash`) or a
+## row id; without a key it matches on the message text through a hash index.
+## finalize_parquet() does the same file to file for frames that don't fit in memory.
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+def text_hash64(values):
+    """Vectorized 64-bit hash of a text column (collisions are negligible below billions of unique texts)"""
+    return pd.util.hash_pandas_object(pd.Series(values), index=False).to_numpy()
+
+def build_translation_lookup(df_translate, message_col='message', translated_col='translated_column', key=None):
+    """(key index, translations): one translation per `key` value (e.g. `message_hash` or a row id), or per message"""
+    keys = df_translate[key] if key else df_translate[message_col]
+    first = ~keys.duplicated().to_numpy()
+    return pd.Index(keys[first]), df_translate[translated_col].array[first]
+
+def finalize_frame(df, lookup, message_col='message', language_col='language_label', target_lang='en',
+                   out_col='final_message_text', key=None, partition_rows=1_000_000):
+    """Add `out_col` to df in place: the message if it is in `target_lang`, else its translation (NaN if missing)"""
+    index, translations = lookup
+    final = df[message_col].copy()
+    languages = df[language_col].to_numpy()
+    keys = df[key] if key else df[message_col]
+    for start in range(0, len(df), partition_rows):
+        ## only the non-English rows of the partition are looked up
+        todo = np.flatnonzero(languages[start:start + partition_rows] != target_lang) + start
+        positions = index.get_indexer(keys.iloc[todo])
+        final.iloc[todo] = translations.take(positions, allow_fill=True)
+    df[out_col] = final
+    return df
+
+def finalize_parquet(src_path, dest_path, lookup, batch_size=500_000, **kwargs):
+    """finalize_frame over a Parquet file, one batch in memory at a time"""
+    writer = None
+    for batch in pq.ParquetFile(src_path).iter_batches(batch_size=batch_size):
+        part = finalize_frame(batch.to_pandas(), lookup, **kwargs)
+        table = pa.Table.from_pandas(part, preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(dest_path, table.schema, compression='zstd')
+        writer.write_table(table.cast(writer.schema))
+    if writer is not None:
+        writer.close()
+
+def benchmark_finalize(n_rows=1_000_000, n_unique=200_000, english_share=0.6, seed=0):
+    """Time the merge above against finalize_frame on synthetic data and check they agree"""
+    rng = np.random.default_rng(seed)
+    messages = np.array([f"message number {i} with some text" for i in range(n_unique)], dtype=object)
+    df_final = pd.DataFrame({'message': messages[rng.integers(0, n_unique, n_rows)],
+                             'language_label': np.where(rng.random(n_rows) < english_share, 'en', 'es'),
+                             'other': rng.random(n_rows)})
+    df_translate = pd.DataFrame({'message': messages, 'translated_column': [f"[en] {m}" for m in messages]})
+
+    start = time.perf_counter()
+    df_merged = df_final.merge(df_translate[['message', 'translated_column']], on='message', how='left')
+    df_merged['final_message_text'] = np.where(df_merged['language_label'] == 'en',
+                                               df_merged['message'], df_merged['translated_column'])
+    df_merged = df_merged.drop(columns=['translated_column'])
+    timings = {'merge': time.perf_counter() - start}
 
-# 1. First, merge df_translate back to df_final
-# Make sure you're merging on the correct column(s) that link these DataFrames
-df_merged = df_final.merge(df_translate[['message', 'translated_column']], on='message', how='left')
+    start = time.perf_counter()
+    df_text = finalize_frame(df_final.copy(), build_translation_lookup(df_translate))
+    timings['finalize_frame (text key)'] = time.perf_counter() - start
 
-# 2. Now create the new column 'final_message_text'
-df_merged['final_message_text'] = np.where(
-    df_merged['language_label'] == 'en',
-    df_merged['message'],  # If English, use original message
-    df_merged['translated_column']  # If not English, use translated text
-)
+    ## the hash is computed once, when the frames are built, and reused by every finalize
+    start = time.perf_counter()
+    df_final['message_hash'] = text_hash64(df_final['message'])
+    df_translate['message_hash'] = text_hash64(df_translate['message'])
+    timings['text_hash64 (one-off)'] = time.perf_counter() - start
+    start = time.perf_counter()
+    df_hash = finalize_frame(df_final, build_translation_lookup(df_translate, key='message_hash'), key='message_hash')
+    timings['finalize_frame (hash key)'] = time.perf_counter() - start
 
-# 3. If you want to drop the intermediate columns:
-df_merged = df_merged.drop(columns=['translated_column'])
+    for df in (df_text, df_hash):
+        assert (df['final_message_text'].to_numpy(dtype=object) == df_merged['final_message_text'].to_numpy(dtype=object)).all()
+    print(f"{n_rows} rows: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in timings.items()))
+    return timings
 
-# 4. If you want to rename df_merged back to df_final:
-df_final = df_merged
+## Usage -- same result as steps 1-4 above, without the merge. The join key is the 64-bit message
+## hash; ideally it is computed once where the frames are built, otherwise it is added here.
+for df in (df_final, df_translate):
+    if 'message_hash' not in df:
+        df['message_hash'] = text_hash64(df['message'])
+df_final = finalize_frame(df_final, build_translation_lookup(df_translate, key='message_hash'), key='message_hash')
+# df_final = finalize_frame(df_final, build_translation_lookup(df_translate))  ## match on the message text instead
+# finalize_parquet('final.parquet', 'final_with_text.parquet', build_translation_lookup(df_translate))  ## larger than memory
+# benchmark_finalize()
@@ -4,44 +4,357 @@
 %%writefile process_skills_behaviors.py
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig
+from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig, BatchEncoding
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from tqdm.notebook import tqdm
 import os
 import argparse
+import multiprocessing
+import json
+import shutil
+import copy
+import hashlib
+from collections import OrderedDict
+import sqlite3
+import threading
+import time
+
+def staging_path(path, staging_dir=None):
+    """Temp path to write `path` to before os.replace-ing it into place.
+
+    It lives outside the output folder (default: `<folder>.staging` next to it), so with
+    s3_upload_mode='Continuous' half-written files are never uploaded. It must be on the
+    same filesystem as `path` for the final os.replace to be atomic.
+    """
+    folder, name = os.path.split(os.path.abspath(path))
+    staging_dir = staging_dir or folder + '.staging'
+    os.makedirs(staging_dir, exist_ok=True)
+    return os.path.join(staging_dir, name + '.tmp')
+
+class ResultCache:
+    """Persistent (SQLite) cache of generated outputs, shared by jobs that mount the same file.
+
+    Keys already include the model name and prompt version. Entries are evicted
+    least-recently-used first once more than `max_entries` are stored.
+    """
+
+    def __init__(self, path, max_entries=1_000_000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        ## used from the event loop and the run_async helper thread, access is serialized by the lock
+        ## shard worker processes share the file; wait for their write locks instead of failing
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS results (
+                   key TEXT PRIMARY KEY,
+                   output TEXT NOT NULL,
+                   last_used REAL NOT NULL)"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON results (last_used)")
+        self._conn.commit()
+
+    def lookup(self, keys):
+        found = {}
+        with self._lock:
+            ## sqlite limits the number of bound parameters per statement
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                placeholders = ",".join("?" * len(part))
+                found.update(self._conn.execute(
+                    f"SELECT key, output FROM results WHERE key IN ({placeholders})", part).fetchall())
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE results SET last_used = ? WHERE key = ?", [(now, k) for k in found])
+                self._conn.commit()
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def store(self, items):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO results (key, output, last_used) VALUES (?, ?, ?)",
+                                   [(k, v, now) for k, v in items.items()])
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM results").fetchone()
+            if count > self.max_entries:
+                self._conn.execute("DELETE FROM results WHERE rowid IN "
+                                   "(SELECT rowid FROM results ORDER BY last_used LIMIT ?)", (count - self.max_entries,))
+            self._conn.commit()
+
+    def close(self):
+        """Checkpoint the WAL into the main file (do this before the file is uploaded)"""
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._conn.close()
 
 class SkillBehaviorProcessor:
-    def __init__(self, model_name="google/gemma-2-9b-it", offload_folder="/tmp/offload"):
+    ## Prefix-cache prompt layout (use_prefix_cache=True): the instructions form a shared
+    ## prefix whose key/values are computed once and reused by every batch, so the prefill
+    ## per row only covers the row suffix. The row text therefore comes LAST, unlike the
+    ## original prompts of build_extraction_prompt / build_classification_prompt, and the
+    ## wording differs slightly -- validate extraction quality before making it the default.
+    EXTRACTION_PREFIX = """<start_of_turn>user
+Given the text at the end, identify and extract key phrases related to work behaviors, hard skills, and soft skills demonstrated. Use a step-by-step approach:
+
+Step 1: Identify potential work behaviors, hard skills, and soft skills mentioned in the text.
+Step 2: For each identified item, determine if it's a work behavior, hard skill, or soft skill.
+Step 3: Formulate concise phrases for each work behavior, hard skill, and soft skill.
+Step 4: List the work behaviors, hard skills, and soft skills separately.
+
+Output the results in the following format:
+Work Behaviors:
+1. [Work Behavior phrase]
+2. [Work Behavior phrase]
+3. [Work Behavior phrase]
+
+Hard Skills:
+1. [Hard Skill phrase]
+2. [Hard Skill phrase]
+3. [Hard Skill phrase]
+
+Soft Skills:
+1. [Soft Skill phrase]
+2. [Soft Skill phrase]
+3. [Soft Skill phrase]
+
+If fewer than three are evident for any category, list only those that are clearly demonstrated.
+If there are no hard or soft skills found just say "No skills". 
+If there are no work behaviors found just say "No behaviors". 
+If there are neither skills nor behaviors found in the text just say "None". 
+
+Text:
+"""
+
+    CLASSIFICATION_PREFIX = """<start_of_turn>user
+Given the work behaviors, hard skills, and soft skills listed at the end, classify them into general categories.
+
+Provide a general classification for the behaviors, hard skills, and soft skills. Output the results in the following format:
+Behavior Class: [General category for behaviors]
+Hard Skill Class: [General category for hard skills]
+Soft Skill Class: [General category for soft skills]
+
+If there are no hard or soft skills found just classify it as "No skills". 
+If there are no work behaviors found just classify it as "No behaviors". 
+If there are neither skills nor behaviors found in the text just say "None". 
+
+"""
+
+    ## bump a version when its prompt changes, so cached results of the old prompt are not reused
+    ## (the prompt layout, original or prefix-cache, is part of the cache key as well)
+    PROMPT_VERSIONS = {'extraction': 1, 'classification': 1}
+    ## kinds whose outputs are also kept in the persistent ResultCache
+    PERSISTENT_KINDS = ('classification',)
+
+    def __init__(self, model_name="google/gemma-2-9b-it", offload_folder="/tmp/offload", max_batches_in_flight=2,
+                 use_prefix_cache=False, memo_size=100000, cache_path=None, cache_max_entries=1_000_000,
+                 output_format='parquet', quantize=True, staging_dir=None):
+        self.model_name = model_name
+        self.output_format = output_format  ## format of the results_part_* files: 'parquet' (zstd) or 'csv'
+        self.staging_dir = staging_dir  ## where part files/manifests are written before the move, see staging_path
         self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        ## decoder-only models must be left padded for batched generation
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
         
-        # Quantization configuration
-        bnb_config = BitsAndBytesConfig(
-            load_in_4bit=True,
-            bnb_4bit_use_double_quant=True,
-            bnb_4bit_quant_type="nf4",
-            bnb_4bit_compute_dtype=torch.bfloat16
-        )
-        
-        # Load model with offloading
-        self.model = AutoModelForCausalLM.from_pretrained(
-            model_name,
-            quantization_config=bnb_config,
-            device_map="auto",
-            torch_dtype=torch.bfloat16,
-            offload_folder=offload_folder
-        )
+        if quantize:
+            # Quantization configuration
+            bnb_config = BitsAndBytesConfig(
+                load_in_4bit=True,
+                bnb_4bit_use_double_quant=True,
+                bnb_4bit_quant_type="nf4",
+                bnb_4bit_compute_dtype=torch.bfloat16
+            )
+            
+            # Load model with offloading
+            self.model = AutoModelForCausalLM.from_pretrained(
+                model_name,
+                quantization_config=bnb_config,
+                device_map="auto",
+                torch_dtype=torch.bfloat16,
+                offload_folder=offload_folder
+            )
+        else:
+            # Full precision on CPU (bitsandbytes 4-bit needs a GPU), e.g. for local runs with a tiny model
+            self.model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=torch.float32)
 
         # Enable gradient checkpointing
         self.model.gradient_checkpointing_enable()
 
+        # Async execution model: a single inference worker owns the model (its queue
+        # serializes generate calls), while tokenization/decoding run on a CPU pool so
+        # they overlap with generation of the previous batch
+        self.inference_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+        self.cpu_pool = ThreadPoolExecutor(max_workers=max(1, (os.cpu_count() or 2) // 2), thread_name_prefix="tokenize")
+        self.max_batches_in_flight = max_batches_in_flight
+
+        # Prompt-prefix KV cache (opt-in, uses the reordered prompts): prefix text -> token ids / past key values
+        self.use_prefix_cache = use_prefix_cache
+        self.prefix_ids = {}
+        self.prefix_caches = {}
+
+        # Dedupe-and-fanout: identical (normalized) inputs are generated once; recent
+        # outputs are kept in a bounded memo so repeats in later blocks are free too
+        self.memo = OrderedDict()
+        self.memo_size = memo_size
+        self.dedup_stats = {'rows': 0, 'generated': 0, 'cached': 0}
+
+        # Persistent classification cache (see ResultCache), shared across runs
+        self.result_cache = ResultCache(cache_path, cache_max_entries) if cache_path else None
+
     def generate_text(self, prompt, max_new_tokens=256):
         inputs = self.tokenizer(prompt, return_tensors="pt").to(self.model.device)
         outputs = self.model.generate(**inputs, max_new_tokens=max_new_tokens)
         return self.tokenizer.decode(outputs[0], skip_special_tokens=True)
 
-    async def generate_pseudo_label_async(self, text):
-        prompt = f"""<start_of_turn>user
+    def _prefix_ids(self, prefix):
+        if prefix not in self.prefix_ids:
+            self.prefix_ids[prefix] = self.tokenizer(prefix, return_tensors="pt")["input_ids"]
+        return self.prefix_ids[prefix]
+
+    def _prefix_cache(self, prefix):
+        """Past key/values of `prefix`, computed once on the inference worker (None if unsupported)"""
+        if prefix not in self.prefix_caches:
+            try:
+                from transformers import DynamicCache  ## not available in older transformers
+                cache = DynamicCache()
+                with torch.inference_mode():
+                    self.model(input_ids=self._prefix_ids(prefix).to(self.model.device),
+                               past_key_values=cache, use_cache=True)
+            except Exception as e:
+                ## older transformers / cache types that can't be reused: fall back to full prefill
+                print(f"Prefix cache disabled: {e}")
+                cache = None
+            self.prefix_caches[prefix] = cache
+        return self.prefix_caches[prefix]
+
+    def _tokenize(self, prompts, prefix=None):
+        """Tokenize a batch. With a `prefix`, `prompts` are the row suffixes and the batch is
+        laid out as [prefix][padding][suffix] so every row shares the prefix positions."""
+        if prefix is None:
+            return self.tokenizer(prompts, return_tensors="pt", padding=True)
+        suffixes = self.tokenizer(prompts, return_tensors="pt", padding=True, add_special_tokens=False)
+        prefix_ids = self._prefix_ids(prefix).expand(len(prompts), -1)
+        return BatchEncoding({
+            "input_ids": torch.cat([prefix_ids, suffixes["input_ids"]], dim=1),
+            "attention_mask": torch.cat([torch.ones_like(prefix_ids), suffixes["attention_mask"]], dim=1),
+        })
+
+    def _generate(self, inputs, max_new_tokens=256, prefix=None):
+        """Generate on the model.
+
+        Without a `prefix` the full sequences (prompt + answer) are returned, which is what
+        the parsers were written against. With a prefix only the new tokens are returned:
+        the prefix-cache prompts put the row text after the output template.
+        """
+        inputs = inputs.to(self.model.device)
+        input_length = inputs["input_ids"].shape[1]
+        cache = self._prefix_cache(prefix) if prefix is not None else None
+        ## a DynamicCache keeps every position; past a sliding window (Gemma 2) it would no
+        ## longer match the model's own cache, so such batches run without the prefix cache
+        sliding_window = getattr(self.model.config, "sliding_window", None)
+        if cache is not None and sliding_window and input_length + max_new_tokens > sliding_window:
+            cache = None
+        outputs = None
+        if cache is not None:
+            try:
+                ## generate() skips the positions already in the cache, i.e. prefills only the suffixes
+                cache = copy.deepcopy(cache)
+                cache.batch_repeat_interleave(inputs["input_ids"].shape[0])
+                ## models that set a cache_implementation (Gemma 2: "hybrid") reject a passed-in cache
+                generation_config = copy.deepcopy(self.model.generation_config)
+                generation_config.cache_implementation = None
+                with torch.inference_mode():
+                    outputs = self.model.generate(**inputs, generation_config=generation_config,
+                                                  max_new_tokens=max_new_tokens,
+                                                  pad_token_id=self.tokenizer.pad_token_id, past_key_values=cache)
+            except Exception as e:
+                print(f"Prefix cache disabled: {e}")
+                self.prefix_caches[prefix] = None
+                outputs = None
+        if outputs is None:
+            with torch.inference_mode():
+                outputs = self.model.generate(**inputs, max_new_tokens=max_new_tokens,
+                                              pad_token_id=self.tokenizer.pad_token_id)
+        if prefix is None:
+            return outputs.cpu()
+        return outputs[:, input_length:].cpu()
+
+    def _decode(self, outputs):
+        return self.tokenizer.batch_decode(outputs, skip_special_tokens=True)
+
+    def generate_batch(self, prompts, max_new_tokens=256, prefix=None):
+        """Pad + tokenize a whole batch, call model.generate once and decode in bulk"""
+        return self._decode(self._generate(self._tokenize(prompts, prefix), max_new_tokens, prefix))
+
+    async def generate_batch_async(self, prompts, max_new_tokens=256, prefix=None):
+        """Non-blocking generate_batch: tokenize/decode on the CPU pool, generate on the inference worker"""
+        loop = asyncio.get_running_loop()
+        inputs = await loop.run_in_executor(self.cpu_pool, self._tokenize, prompts, prefix)
+        outputs = await loop.run_in_executor(self.inference_worker, self._generate, inputs, max_new_tokens, prefix)
+        return await loop.run_in_executor(self.cpu_pool, self._decode, outputs)
+
+    @staticmethod
+    def length_buckets(lengths, batch_size):
+        """Group indices of similar length into batches so little padding is wasted"""
+        order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+        return [order[i:i+batch_size] for i in range(0, len(order), batch_size)]
+
+    async def generate_bucketed_async(self, prompts, batch_size=32, max_new_tokens=256, desc="Generating", show_progress=True,
+                                      prefix=None):
+        """Batched generation over many prompts (length-bucketed), results in input order.
+
+        Up to `max_batches_in_flight` batches are in the pipeline at once so the next
+        batch is tokenized while the current one is generating.
+        """
+        loop = asyncio.get_running_loop()
+        encoded = await loop.run_in_executor(self.cpu_pool, lambda: self.tokenizer(prompts, add_special_tokens=False))
+        lengths = [len(ids) for ids in encoded["input_ids"]]
+        buckets = self.length_buckets(lengths, batch_size)
+        results = [None] * len(prompts)
+        semaphore = asyncio.Semaphore(self.max_batches_in_flight)
+        progress = tqdm(total=len(buckets), desc=desc, disable=not show_progress)
+
+        async def run_bucket(bucket):
+            async with semaphore:
+                outputs = await self.generate_batch_async([prompts[i] for i in bucket], max_new_tokens, prefix)
+            for i, output in zip(bucket, outputs):
+                results[i] = output
+            progress.update(1)
+
+        await asyncio.gather(*(run_bucket(bucket) for bucket in buckets))
+        progress.close()
+        return results
+
+    @staticmethod
+    def extraction_suffix(text):
+        return f'''"{text}"
+<end_of_turn>
+<start_of_turn>model
+'''
+
+    @staticmethod
+    def classification_suffix(behaviors, hard_skills, soft_skills):
+        return f"""Work Behaviors: {behaviors}
+Hard Skills: {hard_skills}
+Soft Skills: {soft_skills}
+<end_of_turn>
+<start_of_turn>model
+"""
+
+    @staticmethod
+    def build_extraction_prompt(text):
+        return f"""<start_of_turn>user
 Given the following text, identify and extract key phrases related to work behaviors, hard skills, and soft skills demonstrated. Use a step-by-step approach:
 
 Text: "{text}"
@@ -74,10 +387,10 @@ If there are neither skills nor behaviors found in the text just say "None".
 <end_of_turn>
 <start_of_turn>model
 """
-        return self.generate_text(prompt)
 
-    async def classify_behaviors_and_skills_async(self, behaviors, hard_skills, soft_skills):
-        prompt = f"""<start_of_turn>user
+    @staticmethod
+    def build_classification_prompt(behaviors, hard_skills, soft_skills):
+        return f"""<start_of_turn>user
 Given the following work behaviors, hard skills, and soft skills, classify them into general categories:
 
 Work Behaviors: {behaviors}
@@ -95,31 +408,43 @@ If there are neither skills nor behaviors found in the text just say "None".
 <end_of_turn>
 <start_of_turn>model
 """
-        return self.generate_text(prompt)
+
+    def extraction_requests(self, texts):
+        """(prompts, prefix) for generate_*: prefix-cache suffixes + shared prefix, or the original full prompts"""
+        if self.use_prefix_cache:
+            return [self.extraction_suffix(text) for text in texts], self.EXTRACTION_PREFIX
+        return [self.build_extraction_prompt(text) for text in texts], None
+
+    def classification_requests(self, triples):
+        if self.use_prefix_cache:
+            return [self.classification_suffix(*triple) for triple in triples], self.CLASSIFICATION_PREFIX
+        return [self.build_classification_prompt(*triple) for triple in triples], None
+
+    async def generate_pseudo_label_async(self, text):
+        prompts, prefix = self.extraction_requests([text])
+        return (await self.generate_batch_async(prompts, prefix=prefix))[0]
+
+    async def classify_behaviors_and_skills_async(self, behaviors, hard_skills, soft_skills):
+        return (await self.generate_unique_async(
+            'classification', [(behaviors, hard_skills, soft_skills)], self.classification_requests, 1))[0]
 
     async def process_extraction_batch_async(self, batch):
-        return [await self.generate_pseudo_label_async(text) for text in batch]
+        prompts, prefix = self.extraction_requests(batch)
+        return await self.generate_batch_async(prompts, prefix=prefix)
 
     async def process_classification_batch_async(self, batch):
-        return [await self.classify_behaviors_and_skills_async(row['work_behaviors'], row['hard_skills'], row['soft_skills']) for _, row in batch.iterrows()]
+        prompts, prefix = self.classification_requests(
+            [(row['work_behaviors'], row['hard_skills'], row['soft_skills']) for _, row in batch.iterrows()])
+        return await self.generate_batch_async(prompts, prefix=prefix)
 
     async def process_extraction_dataframe_async(self, series, batch_size=10):
-        results = []
-        total_batches = (len(series) + batch_size - 1) // batch_size
-        for i in tqdm(range(0, len(series), batch_size), total=total_batches, desc="Processing extraction batches"):
-            batch = series.iloc[i:i+batch_size]
-            batch_results = await self.process_extraction_batch_async(batch)
-            results.extend(batch_results)
-        return results
+        prompts, prefix = self.extraction_requests(series)
+        return await self.generate_bucketed_async(prompts, batch_size, desc="Processing extraction batches", prefix=prefix)
 
     async def process_classification_dataframe_async(self, df, chunk_size=100):
-        results = []
-        total_chunks = (len(df) + chunk_size - 1) // chunk_size
-        for i in tqdm(range(0, len(df), chunk_size), total=total_chunks, desc="Processing classification chunks"):
-            chunk = df.iloc[i:i+chunk_size]
-            batch_results = await self.process_classification_batch_async(chunk)
-            results.extend(batch_results)
-        return results
+        prompts, prefix = self.classification_requests(
+            [(row['work_behaviors'], row['hard_skills'], row['soft_skills']) for _, row in df.iterrows()])
+        return await self.generate_bucketed_async(prompts, chunk_size, desc="Processing classification chunks", prefix=prefix)
 
     @staticmethod
     def extract_skills_and_behaviors(text):
@@ -155,64 +480,505 @@ If there are neither skills nor behaviors found in the text just say "None".
         return behavior_class, hard_skill_class, soft_skill_class
 
     def run_async(self, coro):
-        return asyncio.get_event_loop().run_until_complete(coro)
+        """Run a coroutine to completion from sync code, with or without a running event loop"""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            ## plain script: no loop running yet
+            return asyncio.run(coro)
+        ## inside Jupyter's running loop: run on a fresh loop in a helper thread
+        ## (from a notebook you can also just `await processor.process_..._async(...)`)
+        with ThreadPoolExecutor(max_workers=1) as runner:
+            return runner.submit(asyncio.run, coro).result()
 
-    def process_dataframe(self, df, extraction_batch_size=32, classification_chunk_size=128, save_interval=10000, output_dir='/opt/ml/processing/output'):
-        print(f"Processing dataframe with {len(df)} rows")
-        
-        result_df = df.copy()
-        
-        print("Extracting skills and behaviors...")
-        pseudo_labels = self.run_async(self.process_extraction_dataframe_async(result_df['english_message'], extraction_batch_size))
-        result_df['pseudo_labels'] = pseudo_labels
-        result_df['work_behaviors'], result_df['hard_skills'], result_df['soft_skills'] = zip(*result_df['pseudo_labels'].apply(self.extract_skills_and_behaviors))
-        
-        print("Classifying behaviors and skills...")
-        temp_df = result_df[['work_behaviors', 'hard_skills', 'soft_skills']].copy()
-        classifications = self.run_async(self.process_classification_dataframe_async(temp_df, classification_chunk_size))
-        result_df['classifications'] = classifications
-        result_df['behavior_class'], result_df['hard_skill_class'], result_df['soft_skill_class'] = zip(*result_df['classifications'].apply(self.extract_classifications))
-        
-        # Periodic saving
+    @staticmethod
+    def dedup_key(kind, value):
+        """Hash of the whitespace-normalized input (a text or a tuple of texts); case is kept,
+        since outputs such as pseudo_labels repeat the input text"""
+        parts = value if isinstance(value, tuple) else (value,)
+        normalized = '\x1f'.join(' '.join(str(part).split()) for part in parts)
+        return hashlib.sha1(f'{kind}\x1e{normalized}'.encode('utf-8')).hexdigest()
+
+    async def generate_unique_async(self, kind, values, build_requests, batch_size):
+        """Generate once per unique input and scatter the outputs back to every matching row.
+
+        `kind` namespaces the memo ('extraction'/'classification'), `build_requests`
+        turns the unique values into (prompts, prefix). Outputs of PERSISTENT_KINDS
+        are also looked up in / written to the persistent result cache.
+        """
+        layout = 'prefix' if self.use_prefix_cache else 'full'
+        namespace = f"{kind}|{self.model_name}|v{self.PROMPT_VERSIONS[kind]}|{layout}"
+        keys = [self.dedup_key(namespace, value) for value in values]
+        outputs = {}
+        todo = []
+        for key, value in zip(keys, values):
+            if key in outputs:
+                continue
+            if key in self.memo:
+                self.memo.move_to_end(key)
+                outputs[key] = self.memo[key]
+                continue
+            outputs[key] = None
+            todo.append((key, value))
+        persistent = self.result_cache if kind in self.PERSISTENT_KINDS else None
+        cached = 0
+        if todo and persistent is not None:
+            found = persistent.lookup([key for key, _ in todo])
+            outputs.update(found)
+            cached = len(found)
+            todo = [(key, value) for key, value in todo if key not in found]
+        if todo:
+            prompts, prefix = build_requests([value for _, value in todo])
+            generated = await self.generate_bucketed_async(prompts, batch_size, show_progress=False, prefix=prefix)
+            for (key, _), output in zip(todo, generated):
+                outputs[key] = output
+            if persistent is not None:
+                persistent.store({key: outputs[key] for key, _ in todo})
+        for key in outputs:
+            self.memo[key] = outputs[key]
+        while len(self.memo) > self.memo_size:
+            self.memo.popitem(last=False)
+        self.dedup_stats['rows'] += len(values)
+        self.dedup_stats['generated'] += len(todo)
+        self.dedup_stats['cached'] += cached
+        return [outputs[key] for key in keys]
+
+    async def process_block_async(self, block, extraction_batch_size=32, classification_chunk_size=128):
+        """Extraction -> parsing -> classification for one block of rows"""
+        result = block.copy()
+        pseudo_labels = await self.generate_unique_async(
+            'extraction', list(block['english_message']), self.extraction_requests, extraction_batch_size)
+        result['pseudo_labels'] = pseudo_labels
+        ## parsed extraction goes straight to classification, no full-frame pass in between
+        parsed = [self.extract_skills_and_behaviors(label) for label in pseudo_labels]
+        result['work_behaviors'], result['hard_skills'], result['soft_skills'] = zip(*parsed)
+        classifications = await self.generate_unique_async(
+            'classification', parsed, self.classification_requests, classification_chunk_size)
+        result['classifications'] = classifications
+        parsed_classes = [self.extract_classifications(c) for c in classifications]
+        result['behavior_class'], result['hard_skill_class'], result['soft_skill_class'] = zip(*parsed_classes)
+        return result
+
+    @staticmethod
+    def iter_blocks(df, block_size, ranges=None):
+        """(first row number, block) pairs over the given row ranges of a dataframe (default: all rows)"""
+        for range_start, range_end in ranges if ranges is not None else [(0, len(df))]:
+            for start in range(range_start, range_end, block_size):
+                yield start, df.iloc[start:min(start+block_size, range_end)]
+
+    #### Checkpointing -- progress.json lists the row ranges already written to results_part_*.csv
+    @staticmethod
+    def load_progress(output_dir):
+        path = os.path.join(output_dir, 'progress.json')
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    @staticmethod
+    def save_progress(output_dir, progress, staging_dir=None):
+        """Atomic write so an interruption never leaves a broken manifest"""
+        path = os.path.join(output_dir, 'progress.json')
+        tmp_path = staging_path(path, staging_dir)
+        with open(tmp_path, 'w') as f:
+            json.dump(progress, f, indent=1)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def remaining_ranges(total_rows, done_ranges, start=0):
+        """Row ranges of [start, total_rows) not covered by `done_ranges`"""
+        remaining, position = [], start
+        for done_start, done_end in sorted(done_ranges):
+            if done_start >= total_rows:
+                break
+            if done_start > position:
+                remaining.append((position, done_start))
+            position = max(position, done_end)
+        if position < total_rows:
+            remaining.append((position, total_rows))
+        return remaining
+
+    @staticmethod
+    def is_result_part(name):
+        return name.startswith('results_part_') and name.endswith(('.csv', '.parquet'))
+
+    @classmethod
+    def clear_outputs(cls, output_dir):
+        """Remove part files and the manifest of a previous run"""
+        for f in os.listdir(output_dir):
+            if cls.is_result_part(f) or f.startswith('progress.json'):
+                os.remove(os.path.join(output_dir, f))
+
+    def flush_results(self, blocks, output_dir, progress):
+        """Write contiguous finished blocks as one part file, then record the range in the manifest"""
+        start = blocks[0][0]
+        end = blocks[-1][0] + len(blocks[-1][1])
+        path = os.path.join(output_dir, f'results_part_{start:010d}_{end:010d}.{self.output_format}')
+        part = pd.concat([block for _, block in blocks])
+        tmp_path = staging_path(path, self.staging_dir)
+        if self.output_format == 'parquet':
+            part.to_parquet(tmp_path, index=False, compression='zstd')
+        else:
+            part.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, path)
+        progress['done'].append([start, end])
+        self.save_progress(output_dir, progress, self.staging_dir)
+        print(f"Checkpointed rows {start}-{end}")
+
+    async def process_blocks_async(self, blocks, progress, extraction_batch_size=32, classification_chunk_size=128,
+                                   save_interval=10000, output_dir='/opt/ml/processing/output',
+                                   max_blocks_in_flight=2, total_blocks=None):
+        """Streaming pipeline over (start, block) pairs.
+
+        Up to `max_blocks_in_flight` blocks are processed at once (extraction of the
+        next block overlaps classification of the current one on the inference
+        queue). Finished blocks are flushed in order every `save_interval` rows and
+        their row range is recorded in `progress`, so peak memory stays bounded and
+        an interrupted job can resume. Returns (rows processed, first finished block).
+        """
         os.makedirs(output_dir, exist_ok=True)
-        for i in range(0, len(result_df), save_interval):
-            chunk = result_df.iloc[i:i+save_interval]
-            chunk.to_csv(f'{output_dir}/results_chunk_{i//save_interval}.csv', index=False)
-            print(f"Saved chunk {i//save_interval}")
-        
-        print(f"Processed {len(result_df)} rows")
-        print(f"Sample results:\n{result_df[['english_message', 'work_behaviors', 'hard_skills', 'soft_skills', 'behavior_class', 'hard_skill_class', 'soft_skill_class']].head()}")
-        
+        blocks = iter(blocks)
+        pending = []
+        finished = []
+        rows_done = 0
+        first_block = None
+        bar = tqdm(total=total_blocks, desc="Processing blocks")
+
+        def schedule():
+            for start, block in blocks:
+                pending.append((start, asyncio.ensure_future(
+                    self.process_block_async(block, extraction_batch_size, classification_chunk_size))))
+                if len(pending) >= max_blocks_in_flight:
+                    return
+
+        schedule()
+        try:
+            while pending:
+                start, task = pending.pop(0)
+                result = await task
+                ## only contiguous rows go into one part file
+                if finished and finished[-1][0] + len(finished[-1][1]) != start:
+                    self.flush_results(finished, output_dir, progress)
+                    finished = []
+                finished.append((start, result))
+                if sum(len(block) for _, block in finished) >= save_interval:
+                    self.flush_results(finished, output_dir, progress)
+                    finished = []
+                rows_done += len(result)
+                if first_block is None:
+                    first_block = result
+                bar.update(1)
+                schedule()
+        finally:
+            ## on failure, keep what is finished and stop the blocks still in flight
+            for _, task in pending:
+                task.cancel()
+            if finished:
+                self.flush_results(finished, output_dir, progress)
+            bar.close()
+        return rows_done, first_block
+
+    def start_progress(self, output_dir, resume, input_name, total_rows, shard=None):
+        """Load the manifest of an interrupted run (resume) or start a fresh one"""
+        os.makedirs(output_dir, exist_ok=True)
+        progress = self.load_progress(output_dir) if resume else None
+        if progress is not None:
+            if progress['total_rows'] != total_rows or progress['input'] != input_name:
+                raise ValueError(f"progress.json in {output_dir} belongs to {progress['input']} "
+                                 f"({progress['total_rows']} rows), not {input_name} ({total_rows} rows)")
+            ## a different sharding would hand finished rows to other shards and duplicate them
+            if progress.get('shard') != shard:
+                raise ValueError(f"progress.json in {output_dir} was written by shard {progress.get('shard')}, not {shard}")
+            print(f"Resuming: {sum(end - start for start, end in progress['done'])} rows already done")
+        else:
+            self.clear_outputs(output_dir)
+            progress = {'input': input_name, 'total_rows': total_rows, 'done': [], 'shard': shard}
+            self.save_progress(output_dir, progress, self.staging_dir)
+        return progress
+
+    def run_blocks(self, blocks, progress, extraction_batch_size, classification_chunk_size, save_interval,
+                   output_dir, max_blocks_in_flight, total_blocks=None):
+        print("Extracting and classifying skills and behaviors...")
+        self.dedup_stats = {'rows': 0, 'generated': 0, 'cached': 0}
+        rows_done, first_block = self.run_async(self.process_blocks_async(
+            blocks, progress, extraction_batch_size, classification_chunk_size,
+            save_interval, output_dir, max_blocks_in_flight, total_blocks))
+
+        print(f"Processed {rows_done} rows")
+        if self.dedup_stats['rows']:
+            print(f"Dedup: {self.dedup_stats['generated']} generations for {self.dedup_stats['rows']} prompts "
+                  f"({1 - self.dedup_stats['generated'] / self.dedup_stats['rows']:.1%} saved, "
+                  f"{self.dedup_stats['cached']} from the persistent cache)")
+        if first_block is not None:
+            print(f"Sample results:\n{first_block[['english_message', 'work_behaviors', 'hard_skills', 'soft_skills', 'behavior_class', 'hard_skill_class', 'soft_skill_class']].head()}")
+        return rows_done
+
+    def process_dataframe(self, df, extraction_batch_size=32, classification_chunk_size=128, save_interval=10000, output_dir='/opt/ml/processing/output',
+                          block_size=None, max_blocks_in_flight=2, resume=False, input_name=None):
+        print(f"Processing dataframe with {len(df)} rows")
+        block_size = block_size or max(extraction_batch_size, classification_chunk_size)
+        progress = self.start_progress(output_dir, resume, input_name, len(df))
+        ranges = self.remaining_ranges(len(df), progress['done'])
+        total_blocks = sum((end - start + block_size - 1) // block_size for start, end in ranges)
+        self.run_blocks(self.iter_blocks(df, block_size, ranges), progress, extraction_batch_size,
+                        classification_chunk_size, save_interval, output_dir, max_blocks_in_flight, total_blocks)
+        ## df is in memory already, so its results are too: read the parts back (including resumed ones)
+        result_df = self.load_results(output_dir)
+        result_df.index = df.index
         return result_df
 
+    @classmethod
+    def load_results(cls, output_dir):
+        """All results_part_* files of output_dir as one dataframe, in row order"""
+        parts = sorted(f for f in os.listdir(output_dir) if cls.is_result_part(f))
+        frames = [pd.read_parquet(os.path.join(output_dir, f)) if f.endswith('.parquet')
+                  else pd.read_csv(os.path.join(output_dir, f)) for f in parts]
+        return pd.concat(frames, ignore_index=True)
+
+    #### Streaming file input -- only `columns` are read, one block at a time
+    @staticmethod
+    def count_rows(path):
+        """Row count from the Parquet footer (None for CSV, which would need a full pass)"""
+        return pq.ParquetFile(path).metadata.num_rows if path.endswith('.parquet') else None
+
+    @staticmethod
+    def read_input_chunks(path, block_size, columns=('english_message',)):
+        """(first row number, chunk) pairs of a CSV or Parquet file; a `row_id` column keeps the input row number"""
+        if path.endswith('.parquet'):
+            batches = pq.ParquetFile(path).iter_batches(batch_size=block_size, columns=list(columns))
+            chunks = (batch.to_pandas() for batch in batches)
+        else:
+            chunks = pd.read_csv(path, usecols=list(columns), chunksize=block_size)
+        start = 0
+        for chunk in chunks:
+            chunk = chunk.reset_index(drop=True)
+            chunk.insert(0, 'row_id', range(start, start + len(chunk)))
+            yield start, chunk
+            start += len(chunk)
+
+    @staticmethod
+    def owned_ranges(start, end, shard_index=0, num_shards=1, shard_size=10000):
+        """Sub-ranges of [start, end) that belong to a shard.
+
+        Rows are dealt out round-robin in runs of `shard_size` (run k goes to shard
+        k % num_shards), so the split is deterministic and needs no row count.
+        """
+        if num_shards == 1:
+            return [(start, end)] if start < end else []
+        ranges = []
+        run = start // shard_size
+        while run * shard_size < end:
+            if run % num_shards == shard_index:
+                ranges.append((max(start, run * shard_size), min(end, (run + 1) * shard_size)))
+            run += 1
+        return ranges
+
+    def iter_file_blocks(self, path, block_size, columns=('english_message',), done_ranges=(),
+                         shard_index=0, num_shards=1, shard_size=10000):
+        """Blocks of the input file owned by this shard, minus the row ranges already done"""
+        for start, chunk in self.read_input_chunks(path, block_size, columns):
+            for owned_start, owned_end in self.owned_ranges(start, start + len(chunk), shard_index, num_shards, shard_size):
+                for range_start, range_end in self.remaining_ranges(owned_end, done_ranges, owned_start):
+                    yield range_start, chunk.iloc[range_start - start:range_end - start]
+
+    def process_file(self, path, extraction_batch_size=32, classification_chunk_size=128, save_interval=10000,
+                     output_dir='/opt/ml/processing/output', block_size=None, max_blocks_in_flight=2, resume=False,
+                     columns=('english_message',), shard_index=0, num_shards=1, shard_size=10000):
+        """Like process_dataframe, but streams the input so it never has to fit in memory.
+
+        Results stay in the results_part_* files (see merge_result_chunks); returns the
+        number of rows processed. With num_shards > 1 only the rows of shard `shard_index` are processed (see owned_ranges).
+        """
+        block_size = block_size or max(extraction_batch_size, classification_chunk_size)
+        total_rows = self.count_rows(path)
+        print(f"Processing {path} ({total_rows if total_rows is not None else 'unknown number of'} rows), "
+              f"shard {shard_index + 1}/{num_shards}")
+        shard = [shard_index, num_shards, shard_size] if num_shards > 1 else None
+        progress = self.start_progress(output_dir, resume, os.path.basename(path), total_rows, shard)
+        total_blocks = None
+        if total_rows is not None:
+            ranges = [remaining for owned_start, owned_end in self.owned_ranges(0, total_rows, shard_index, num_shards, shard_size)
+                      for remaining in self.remaining_ranges(owned_end, progress['done'], owned_start)]
+            total_blocks = sum((end - start + block_size - 1) // block_size for start, end in ranges)
+        blocks = self.iter_file_blocks(path, block_size, columns, progress['done'], shard_index, num_shards, shard_size)
+        return self.run_blocks(blocks, progress,
+                               extraction_batch_size, classification_chunk_size, save_interval, output_dir,
+                               max_blocks_in_flight, total_blocks)
+
+    @classmethod
+    def merge_result_chunks(cls, output_dir, dest_path, staging_dir=None, part_dirs=None):
+        """Concatenate results_part_* files in row order into one file, one part in memory at a time
+        (written in `staging_dir`, see staging_path).
+
+        With `part_dirs` only the parts directly in those folders are merged (e.g. the shard
+        folders of the current run), otherwise all parts under `output_dir` including shard_*
+        subfolders. Raises ValueError if two parts cover the same rows.
+        """
+        if part_dirs is not None:
+            parts = sorted((f, os.path.join(folder, f)) for folder in part_dirs if os.path.isdir(folder)
+                           for f in os.listdir(folder) if cls.is_result_part(f))
+        else:
+            parts = sorted((f, os.path.join(root, f)) for root, _, files in os.walk(output_dir)
+                           for f in files if cls.is_result_part(f))
+        ## file names start with the global row number: results_part_<start>_<end>
+        previous_end, previous_path = 0, None
+        for name, path in parts:
+            start, end = (int(n) for n in name.split('.')[0].split('_')[2:4])
+            if start < previous_end:
+                raise ValueError(f"{path} and {previous_path} both contain rows {start}-{min(end, previous_end)} "
+                                 f"(leftovers of an earlier run?); remove stale parts before merging")
+            previous_end, previous_path = max(previous_end, end), path
+        parts = [path for _, path in parts]
+        if dest_path.endswith('.parquet'):
+            if not parts:
+                return
+            ## a column that is all null in one part has null type there: unify over all parts
+            ## (footers only) so a null first part doesn't fix the type for the rest
+            schema = pa.unify_schemas([pq.read_schema(name) for name in parts])
+            tmp_path = staging_path(dest_path, staging_dir)
+            with pq.ParquetWriter(tmp_path, schema, compression='zstd') as writer:
+                for name in parts:
+                    writer.write_table(pq.read_table(name).select(schema.names).cast(schema))
+            os.replace(tmp_path, dest_path)
+            return
+        tmp_path = staging_path(dest_path, staging_dir)
+        with open(tmp_path, 'w', encoding='utf-8', newline='') as out:
+            for n, name in enumerate(parts):
+                with open(name, encoding='utf-8', newline='') as part:
+                    header = part.readline()
+                    if n == 0:
+                        out.write(header)
+                    for line in part:
+                        out.write(line)
+        os.replace(tmp_path, dest_path)
+
+#### Sharded execution -- one worker process per device, one set of shards per instance
+def instance_shard():
+    """(index, count) of this instance in a multi-instance SageMaker job, (0, 1) elsewhere"""
+    path = '/opt/ml/config/resourceconfig.json'
+    if not os.path.exists(path):
+        return 0, 1
+    with open(path) as f:
+        config = json.load(f)
+    return config['hosts'].index(config['current_host']), len(config['hosts'])
+
+def staging_root(args):
+    """Temp files go next to the output dir, not in it: it may be uploaded continuously"""
+    return os.path.abspath(args.output_data_dir) + '.staging'
+
+def run_shard(shard_index, num_shards, device, input_file, output_dir, args):
+    """Load a model on `device` ('auto', 'cuda:N' or 'cpu') and process one shard of the input"""
+    if device.startswith('cuda:'):
+        ## must happen before CUDA is initialized in this process
+        os.environ['CUDA_VISIBLE_DEVICES'] = device.split(':')[1]
+    elif device == 'cpu' and args.threads_per_worker:
+        torch.set_num_threads(args.threads_per_worker)
+    processor = SkillBehaviorProcessor(model_name=args.model_name, offload_folder=f'/tmp/offload_{shard_index}',
+                                       cache_path=args.cache_path, output_format=args.output_format,
+                                       use_prefix_cache=args.prefix_cache, quantize=device != 'cpu',
+                                       staging_dir=os.path.join(staging_root(args), f'shard_{shard_index:03d}'))
+    try:
+        processor.process_file(
+            input_file,
+            extraction_batch_size=32,
+            classification_chunk_size=128,
+            save_interval=args.save_interval,
+            output_dir=output_dir,
+            resume=args.resume,
+            columns=args.columns.split(','),
+            shard_index=shard_index,
+            num_shards=num_shards,
+            shard_size=args.shard_size
+        )
+    finally:
+        if processor.result_cache is not None:
+            processor.result_cache.close()
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('--input-data-dir', type=str, default='/opt/ml/processing/input')
     parser.add_argument('--output-data-dir', type=str, default='/opt/ml/processing/output')
+    parser.add_argument('--save-interval', type=int, default=1000) ## rows per checkpoint
+    parser.add_argument('--resume', action='store_true') ## skip rows already listed in progress.json
+    parser.add_argument('--checkpoint-dir', type=str, default=None) ## outputs of the interrupted job (mounted as an input)
+    parser.add_argument('--cache-path', type=str, default='/opt/ml/processing/cache/classification_cache.sqlite') ## persistent classification cache
+    parser.add_argument('--cache-input', type=str, default=None) ## cache file of earlier jobs (mounted as an input)
+    parser.add_argument('--columns', type=str, default='english_message') ## comma-separated input columns to read (and keep)
+    parser.add_argument('--output-format', type=str, default='parquet', choices=['parquet', 'csv'])
+    parser.add_argument('--model-name', type=str, default='google/gemma-2-9b-it')
+    ## reuses the instruction prefix's KV cache; uses the reordered prefix-cache prompts
+    parser.add_argument('--prefix-cache', action='store_true')
+    parser.add_argument('--num-workers', type=int, default=None) ## worker processes on this instance (default: one per GPU)
+    parser.add_argument('--device', type=str, default=None, choices=['cuda', 'cpu']) ## default: cuda if available
+    parser.add_argument('--threads-per-worker', type=int, default=None) ## torch threads of each CPU worker (default: cores / workers)
+    parser.add_argument('--shard-index', type=int, default=None) ## this instance's index (default: from the SageMaker resource config)
+    parser.add_argument('--num-shards', type=int, default=None) ## number of instances (default: from the SageMaker resource config)
+    parser.add_argument('--shard-size', type=int, default=10000) ## rows dealt to a shard at a time
     args, _ = parser.parse_known_args()
     
-    # Initialize the processor
-    processor = SkillBehaviorProcessor(offload_folder='/tmp/offload')
+    # Start from the classification cache of earlier jobs, if one was mounted
+    if args.cache_input and os.path.exists(args.cache_input) and not os.path.exists(args.cache_path):
+        os.makedirs(os.path.dirname(args.cache_path), exist_ok=True)
+        shutil.copy(args.cache_input, args.cache_path)
     
-    # Load your data
-    input_files = [f for f in os.listdir(args.input_data_dir) if f.endswith('.csv')]
+    # Find your data (CSV or Parquet) -- it is streamed block by block, not loaded
+    input_files = sorted(f for f in os.listdir(args.input_data_dir) if f.endswith(('.csv', '.parquet')))
     if not input_files:
-        raise ValueError(f"No CSV files found in {args.input_data_dir}")
+        raise ValueError(f"No CSV or Parquet files found in {args.input_data_dir}")
     
     input_file = os.path.join(args.input_data_dir, input_files[0])
-    df_qlik = pd.read_csv(input_file)
     
-    # Process the DataFrame
-    result_df = processor.process_dataframe(
-        df_qlik,
-        extraction_batch_size=32,
-        classification_chunk_size=128,
-        save_interval=10000,
-        output_dir=args.output_data_dir
-    )
+    # Shards: num_workers per instance x number of instances, numbered instance by instance
+    instance_index, instance_count = instance_shard()
+    instance_index = args.shard_index if args.shard_index is not None else instance_index
+    instance_count = args.num_shards if args.num_shards is not None else instance_count
+    device = args.device or ('cuda' if torch.cuda.is_available() else 'cpu')
+    num_workers = args.num_workers or (max(1, torch.cuda.device_count()) if device == 'cuda' else 1)
+    if args.threads_per_worker is None and num_workers > 1:
+        ## a single worker keeps torch's default (all cores)
+        args.threads_per_worker = max(1, (os.cpu_count() or 1) // num_workers)
+    num_shards = instance_count * num_workers
+    shards = [instance_index * num_workers + worker for worker in range(num_workers)]
+    shard_dirs = {shard: os.path.join(args.output_data_dir, f'shard_{shard:03d}') if num_shards > 1 else args.output_data_dir
+                  for shard in shards}
+    
+    # Resuming on a new job: bring the checkpoint of the interrupted job into the output dir
+    if args.resume and args.checkpoint_dir:
+        os.makedirs(args.output_data_dir, exist_ok=True)
+        for f in os.listdir(args.checkpoint_dir):
+            ## is_result_part skips *.tmp files an older version of this script may have uploaded
+            if SkillBehaviorProcessor.is_result_part(f) or f == 'progress.json':
+                shutil.copy(os.path.join(args.checkpoint_dir, f), args.output_data_dir)
+        for shard, shard_dir in shard_dirs.items():
+            checkpoint_shard_dir = os.path.join(args.checkpoint_dir, os.path.basename(shard_dir))
+            if num_shards > 1 and os.path.isdir(checkpoint_shard_dir):
+                shutil.copytree(checkpoint_shard_dir, shard_dir, dirs_exist_ok=True,
+                                ignore=shutil.ignore_patterns('*.tmp'))
     
-    # Save the final results
-    result_df.to_csv(os.path.join(args.output_data_dir, 'final_results.csv'), index=False)
+    # Process the file -- results_part_* files are checkpointed as blocks finish
+    if num_shards == 1:
+        run_shard(0, 1, 'auto' if device == 'cuda' else 'cpu', input_file, args.output_data_dir, args)
+    else:
+        print(f"Instance {instance_index + 1}/{instance_count}: running shards {shards} of {num_shards}")
+        context = multiprocessing.get_context('spawn')  ## CUDA can't be used in forked children
+        workers = [context.Process(target=run_shard, args=(shard, num_shards,
+                                                            f'cuda:{worker % max(1, torch.cuda.device_count())}' if device == 'cuda' else 'cpu',
+                                                            input_file, shard_dirs[shard], args))
+                   for worker, shard in enumerate(shards)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        failed = [shard for shard, worker in zip(shards, workers) if worker.exitcode != 0]
+        if failed:
+            raise RuntimeError(f"Shards {failed} failed, rerun with --resume to finish them")
+    
+    # Save the final results -- with several instances each one merges its own shards; merging the
+    # downloaded outputs of all instances with merge_result_chunks gives the full result
+    final_name = 'final_results' if instance_count == 1 else f'final_results_instance_{instance_index:03d}'
+    ## only this run's shard folders: parts of an earlier run with another layout may still be around
+    SkillBehaviorProcessor.merge_result_chunks(args.output_data_dir, os.path.join(args.output_data_dir, f'{final_name}.{args.output_format}'),
+                                               staging_dir=staging_root(args), part_dirs=sorted(set(shard_dirs.values())))
     print("Processing complete. Results saved.")
 
 ## -----------------------------------------------------------------------------------------------------
@@ -244,7 +1010,7 @@ pytorch_processor = PyTorchProcessor(
     framework_version='1.10',
     role=role_arn,
     instance_type='ml.g5.2xlarge', ## GPU instance you are using
-    instance_count=1,
+    instance_count=1, ## >1 splits the rows across instances (each runs its own shards, see --num-workers)
     base_job_name='<name of job>',
     py_version='py38'
 )
@@ -261,13 +1027,34 @@ pytorch_processor.run(
         ProcessingOutput(
             output_name='<name_of_output>',
             source='/opt/ml/processing/output',
-            destination='s3://<your bucket name/file_location/outputs'
+            destination='s3://<your bucket name/file_location/outputs',
+            s3_upload_mode='Continuous' ## upload checkpoints as they are written, not only at the end
+                                        ## (temp files are written to /opt/ml/processing/output.staging, which is not uploaded)
         )
     ],
     arguments=['--input-data-dir', '/opt/ml/processing/input',
                '--output-data-dir', '/opt/ml/processing/output']
 )
 
+## With instance_count > 1 keep the input FullyReplicated (the default): every instance reads the same
+## file and takes its own rows. Each instance writes final_results_instance_NNN; to get one file, download
+## the outputs and run SkillBehaviorProcessor.merge_result_chunks('<outputs dir>', 'final_results.parquet').
+## Local test with CPU workers and a tiny model:
+# python process_skills_behaviors.py --input-data-dir data --output-data-dir out --device cpu --num-workers 4 \
+#     --model-name sshleifer/tiny-gpt2 --cache-path out_cache/cache.sqlite
+
+## To share the classification cache across jobs, save it to S3 and mount it in the next job:
+# outputs=[..., ProcessingOutput(output_name='cache', source='/opt/ml/processing/cache',
+#                                destination='s3://<your bucket name/file_location/cache')]
+# inputs=[..., ProcessingInput(source='s3://<your bucket name/file_location/cache',
+#                              destination='/opt/ml/processing/cache_input')]
+# arguments=[..., '--cache-input', '/opt/ml/processing/cache_input/classification_cache.sqlite']
+
+## To resume an interrupted job (e.g. on spot capacity) mount its outputs and pass --resume:
+# inputs=[..., ProcessingInput(source='s3://<your bucket name/file_location/outputs',
+#                              destination='/opt/ml/processing/checkpoint')]
+# arguments=[..., '--resume', '--checkpoint-dir', '/opt/ml/processing/checkpoint']
+
 ## -----------------------------------------------------------------------------------------------------
 ## Step 4: Run the SageMaker Processing job
 ## Run this in a new notebook cell:
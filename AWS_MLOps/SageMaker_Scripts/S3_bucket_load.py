@@ -109,3 +109,130 @@ data_location= 's3://{}/{}'.format(bucket,data_key)
 ## load df
 df = pd.read_csv(data_location, index_col= False, low_memory=False)
 df.head()
+
+
+
+
+## 4. Parallel loading of every file under a prefix
+## Lists all objects under the prefix (paginated, so more than 1000 keys work), downloads them
+## concurrently over one pooled client, parses them in a process pool and returns one concatenated
+## DataFrame -- or a lazy iterator of frames when the data doesn't fit in memory.
+## LocalBackend reads a local folder with the same interface, for tests without S3.
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import boto3
+import pandas as pd
+from botocore.config import Config
+
+SUFFIXES = ('.csv', '.csv.gz', '.parquet', '.pkl', '.json', '.jsonl')
+
+class S3Backend:
+    """Lists and downloads objects of one bucket (boto3 clients are thread-safe and pool connections)"""
+
+    def __init__(self, bucket, client=None, max_pool_connections=32):
+        self.bucket = bucket
+        self.client = client or boto3.client('s3', config=Config(max_pool_connections=max_pool_connections,
+                                                                 retries={'mode': 'adaptive'}))
+
+    def list(self, prefix):
+        for page in self.client.get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                yield obj['Key']
+
+    def download(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=key)['Body'].read()
+
+class LocalBackend:
+    """Same interface over a local folder (keys are paths relative to `root`)"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def list(self, prefix):
+        for folder, _, files in os.walk(self.root):
+            for name in files:
+                key = os.path.relpath(os.path.join(folder, name), self.root).replace(os.sep, '/')
+                if key.startswith(prefix):
+                    yield key
+
+    def download(self, key):
+        with open(os.path.join(self.root, key), 'rb') as f:
+            return f.read()
+
+def parse_object(key, data, read_kwargs=None, add_source=True):
+    """Bytes of one object -> DataFrame, by file extension (module level so process pools can pickle it)"""
+    read_kwargs = read_kwargs or {}
+    buffer = io.BytesIO(data)
+    if key.endswith('.parquet'):
+        df = pd.read_parquet(buffer, **read_kwargs)
+    elif key.endswith('.pkl'):
+        df = pd.read_pickle(buffer, **read_kwargs)
+    elif key.endswith('.jsonl'):
+        df = pd.read_json(buffer, lines=True, **read_kwargs)
+    elif key.endswith('.json'):
+        df = pd.read_json(buffer, **read_kwargs)
+    else:
+        df = pd.read_csv(buffer, compression='gzip' if key.endswith('.gz') else None, **read_kwargs)
+    if add_source:
+        df['source_key'] = key
+    return df
+
+def iter_s3_frames(backend, prefix, suffixes=SUFFIXES, max_downloads=16, parse_workers=None,
+                   read_kwargs=None, add_source=True, mp_context=None):
+    """Yield one DataFrame per object under `prefix`, in key order.
+
+    Up to `max_downloads` objects are downloaded at once and parsed by `parse_workers`
+    processes (0 parses in the download threads, which is cheaper for small files), so
+    at most about 2 * max_downloads objects are held in memory. `mp_context` is passed
+    to the ProcessPoolExecutor (e.g. multiprocessing.get_context('spawn') when the
+    functions live in an importable module rather than a notebook).
+    """
+    keys = sorted(key for key in backend.list(prefix) if key.endswith(tuple(suffixes)))
+    print(f"Found {len(keys)} files under {prefix!r}")
+    parse_workers = os.cpu_count() if parse_workers is None else parse_workers
+    parser = ProcessPoolExecutor(max_workers=parse_workers, mp_context=mp_context) if parse_workers else None
+    if parser is not None:
+        ## start the workers now, before the download threads exist: with the fork start method
+        ## all of them are forked on the first submit, which must not happen in a multithreaded process
+        parser.submit(os.getpid).result()
+
+    def fetch(key):
+        data = backend.download(key)
+        if parser is None:
+            return parse_object(key, data, read_kwargs, add_source)
+        return parser.submit(parse_object, key, data, read_kwargs, add_source)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_downloads) as downloader:
+            ## sliding window: keep 2 * max_downloads objects in flight, hand them out in key order
+            window = 2 * max_downloads
+            pending = [downloader.submit(fetch, key) for key in keys[:window]]
+            for i in range(len(keys)):
+                result = pending[i].result()
+                pending[i] = None  ## drop the reference so memory is released as we go
+                if i + window < len(keys):
+                    pending.append(downloader.submit(fetch, keys[i + window]))
+                yield result.result() if parser is not None else result
+    finally:
+        if parser is not None:
+            parser.shutdown(cancel_futures=True)
+
+def load_s3_prefix(backend, prefix, **kwargs):
+    """All objects under `prefix` as one DataFrame"""
+    frames = list(iter_s3_frames(backend, prefix, **kwargs))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+# Load every CSV/Parquet/... file under a folder of the bucket into one DataFrame
+bucket = '<name of your bucket>'
+folder_path = '<name_of_folder_path/>'
+df = load_s3_prefix(S3Backend(bucket), folder_path)
+print(df.head())
+
+# Or stream the frames one by one when the folder is larger than memory
+# for frame in iter_s3_frames(S3Backend(bucket), folder_path):
+#     ...
+
+# Local test without S3: the same loader over a folder
+# df = load_s3_prefix(LocalBackend('/tmp/s3_mirror'), 'name_of_folder_path/')